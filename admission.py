@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+# Per endpoint concurrency limits, e.g. ADMISSION_LIMITS="/sort=2,/calculate-pi=4".
+# Endpoints not listed use ADMISSION_DEFAULT_LIMIT, 0 leaves them unlimited.
+# Past its limit an endpoint queues up to ADMISSION_QUEUE requests for at
+# most ADMISSION_QUEUE_TIMEOUT seconds, anything else is shed right away.
+# The limits are for the whole server: with several workers each one gets
+# its share, rounded down but at least 1. The queue is per worker.
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", 0))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", 8))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 1.0))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+
+class Shed(Exception):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class Limiter:
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+
+    # Returns True when the request had to wait for a slot, raises Shed with
+    # 429 when the queue is full and 503 when the wait timed out
+    async def acquire(self) -> bool:
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+            return False
+        if self.waiting >= self.queue_size:
+            raise Shed(429, "queue_full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise Shed(503, "queue_timeout")
+        finally:
+            self.waiting -= 1
+        return True
+
+    def release(self):
+        self.semaphore.release()
+
+
+def parse_limits(limits: str) -> dict:
+    parsed = {}
+    for entry in limits.split(","):
+        if "=" in entry:
+            path, limit = entry.split("=", 1)
+            parsed[path.strip()] = int(limit)
+    return parsed
+
+
+# Paths are only limited when they are listed in `limits` or are one of
+# `endpoints`, so unknown urls never allocate a limiter
+class AdmissionControl:
+    def __init__(
+        self,
+        endpoints=(),
+        limits: str = ADMISSION_LIMITS,
+        default_limit: int = ADMISSION_DEFAULT_LIMIT,
+        queue_size: int = ADMISSION_QUEUE,
+        timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        workers: int = 1,
+    ):
+        self.endpoints = set(endpoints)
+        self.limits = parse_limits(limits)
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.workers = workers
+        self.limiters = {}
+
+    # Limiter of the endpoint, None when it is not limited
+    def limiter(self, path: str) -> Limiter:
+        if path in self.limits:
+            limit = self.limits[path]
+        elif path in self.endpoints:
+            limit = self.default_limit
+        else:
+            return None
+        if limit <= 0:
+            return None
+        limit = max(1, limit // self.workers)
+        limiter = self.limiters.get(path)
+        if limiter is None:
+            limiter = self.limiters[path] = Limiter(limit, self.queue_size, self.timeout)
+        return limiter
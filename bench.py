@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import kernels
+
+# Microbenchmarks of the workload kernels, called directly without FastAPI
+# or OpenTelemetry in the way.
+#
+#   python bench.py run --output results.json
+#   python bench.py run --only sort_merge,sort_quick --sizes 1000,10000 --baseline base.json
+#   python bench.py compare base.json results.json --threshold 0.1
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+SORT_SIZES = (100, 1000, 4000)
+PI_SIZES = (10_000, 100_000, 1_000_000)
+SUM_SIZES = (10_000, 1_000_000, 10_000_000)
+OBJECT_SIZES = (10_000, 100_000, 1_000_000)
+
+DEFAULT_WARMUP = 1
+DEFAULT_REPETITIONS = 5
+# Relative slowdown of the median over the baseline reported as a regression
+DEFAULT_THRESHOLD = 0.10
+
+
+def default_sizes(name: str):
+    if name.startswith("sort_"):
+        return SORT_SIZES
+    if name.startswith("pi_"):
+        return PI_SIZES
+    if name.startswith("sum_"):
+        return SUM_SIZES
+    return OBJECT_SIZES
+
+
+# The kernels registry with the default size sweep of each benchmark
+BENCHMARKS = {name: default_sizes(name) for name in kernels.KERNELS}
+
+
+def parse_names(names: str):
+    if not names:
+        return list(BENCHMARKS)
+    selected = [name.strip() for name in names.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}")
+    return selected
+
+
+# Pins the process to one cpu so the scheduler does not migrate it between
+# repetitions; by default the last cpu it is allowed on, which is the least
+# likely to also be serving interrupts. Returns the cpu, or None where
+# affinity cannot be set.
+def pin_cpu(cpu: int = None):
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    allowed = sorted(os.sched_getaffinity(0))
+    if cpu is None:
+        cpu = allowed[-1]
+    os.sched_setaffinity(0, {cpu})
+    return cpu
+
+
+# Times one benchmark at one size: `warmup` untimed calls, then
+# `repetitions` timed ones, each on freshly built input
+def measure(name: str, size: int, warmup: int, repetitions: int, seed: int) -> dict:
+    for _ in range(warmup):
+        kernels.time_kernel(name, size, seed)
+    times = [kernels.time_kernel(name, size, seed) for _ in range(repetitions)]
+    return {
+        "benchmark": name,
+        "size": size,
+        "repetitions": repetitions,
+        "warmup": warmup,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "times": times,
+    }
+
+
+def metadata(cpu) -> dict:
+    return {
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "pinned_cpu": cpu,
+        "timestamp": time.time(),
+    }
+
+
+def run(names, sizes, warmup: int, repetitions: int, seed: int, cpu) -> dict:
+    results = []
+    for name in names:
+        for size in sizes or BENCHMARKS[name]:
+            result = measure(name, size, warmup, repetitions, seed)
+            logger.info(
+                f"{name} size={size}: median {result['median']:.6f}s, "
+                f"min {result['min']:.6f}s, stdev {result['stdev']:.6f}s"
+            )
+            results.append(result)
+    return {"metadata": metadata(cpu), "results": results}
+
+
+# Matches the results of two runs by (benchmark, size) and compares their
+# medians. A ratio above 1 + threshold is a regression, below 1 - threshold
+# an improvement.
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD):
+    previous = {
+        (result["benchmark"], result["size"]): result for result in baseline["results"]
+    }
+    comparisons = []
+    for result in current["results"]:
+        before = previous.get((result["benchmark"], result["size"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        if ratio > 1 + threshold:
+            verdict = "regression"
+        elif ratio < 1 - threshold:
+            verdict = "improvement"
+        else:
+            verdict = "unchanged"
+        comparisons.append(
+            {
+                "benchmark": result["benchmark"],
+                "size": result["size"],
+                "baseline": before["median"],
+                "current": result["median"],
+                "ratio": ratio,
+                "verdict": verdict,
+            }
+        )
+    return comparisons
+
+
+def log_comparisons(comparisons):
+    for comparison in comparisons:
+        message = (
+            f"{comparison['benchmark']} size={comparison['size']}: "
+            f"{comparison['baseline']:.6f}s -> {comparison['current']:.6f}s "
+            f"({comparison['ratio']:.2f}x) {comparison['verdict']}"
+        )
+        if comparison["verdict"] == "regression":
+            logger.warning(message)
+        else:
+            logger.info(message)
+    regressions = sum(1 for c in comparisons if c["verdict"] == "regression")
+    logger.info(f"{len(comparisons)} compared, {regressions} regressions")
+    return regressions
+
+
+def load(file_path: str) -> dict:
+    with open(file_path) as file:
+        return json.load(file)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Workload kernel microbenchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--only", default="", help="comma separated benchmarks")
+    run_parser.add_argument(
+        "--sizes", default="", help="comma separated sizes, overrides every sweep"
+    )
+    run_parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    run_parser.add_argument("--repetitions", type=int, default=DEFAULT_REPETITIONS)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--cpu", type=int, default=None, help="cpu to pin to, -1 to not pin"
+    )
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--baseline", help="results to compare against")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    commands.add_parser("list", help="list the benchmarks and their sizes")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, sweep in BENCHMARKS.items():
+            print(f"{name}: {', '.join(str(size) for size in sweep)}")
+        return 0
+
+    if args.command == "compare":
+        comparisons = compare(load(args.baseline), load(args.current), args.threshold)
+        return 1 if log_comparisons(comparisons) else 0
+
+    if args.repetitions < 1:
+        parser.error("--repetitions must be at least 1")
+    names = parse_names(args.only)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    cpu = None if args.cpu == -1 else pin_cpu(args.cpu)
+    report = run(names, sizes, args.warmup, args.repetitions, args.seed, cpu)
+    if args.baseline:
+        report["baseline"] = args.baseline
+        report["threshold"] = args.threshold
+        report["comparisons"] = compare(load(args.baseline), report, args.threshold)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Results written to {args.output}")
+    if args.baseline:
+        return 1 if log_comparisons(report["comparisons"]) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
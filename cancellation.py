@@ -0,0 +1,226 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+# Relative deadline in seconds a client can send with a request; the work is
+# abandoned once it passes. DEFAULT_REQUEST_TIMEOUT applies when the header
+# is missing, 0 means no deadline.
+DEADLINE_HEADER = b"x-request-timeout"
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", 0))
+
+CLIENT_DISCONNECTED = "client_disconnected"
+DEADLINE_EXCEEDED = "deadline_exceeded"
+JOB_CANCELLED = "job_cancelled"
+REASONS = (CLIENT_DISCONNECTED, DEADLINE_EXCEEDED, JOB_CANCELLED)
+
+# How often a thread waiting on a process pool checks for cancellation
+POLL_INTERVAL = 0.05
+
+# Flags shared with the process pools, one per task in flight (see submit)
+REMOTE_SLOTS = 256
+
+
+class Cancelled(Exception):
+    def __init__(self, reason: str, elapsed: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.elapsed = elapsed
+
+    # raised in a pool process and unpickled in the api
+    def __reduce__(self):
+        return Cancelled, (self.reason, self.elapsed)
+
+
+class CancellationToken:
+    def __init__(self, timeout: float = 0):
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout > 0 else None
+        self.reason = None
+        # flags of the tasks it sent to a process pool
+        self.slots = set()
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+            self._trip_remote()
+
+    def check(self):
+        if self.reason is None and self.deadline is not None:
+            if time.monotonic() > self.deadline:
+                self.cancel(DEADLINE_EXCEEDED)
+        if self.reason is not None:
+            raise Cancelled(self.reason, time.monotonic() - self.started)
+
+    def _trip_remote(self):
+        for slot in list(self.slots):
+            _flags[slot] = REASONS.index(self.reason) + 1
+
+
+_current = contextvars.ContextVar("cancellation_token", default=None)
+
+
+# Called from the hot loops every so often, raises Cancelled once the
+# request that started the work is gone or past its deadline. Outside a
+# request there is no token and it does nothing.
+def check():
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+# Makes check() see `token` in the current context, for work that runs
+# outside a request such as a job
+@contextlib.contextmanager
+def using(token: CancellationToken):
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+# Work sent to a process pool follows the token of the request that sent
+# it. The pools share an array of flags with the api process: a task takes
+# one for as long as it runs and its token sets it when it trips, the
+# task's own check() reads it. The task also gets the deadline, so it stops
+# on time even while nobody in the api polls the token.
+_flags = None
+_free_slots = []
+_slots_lock = threading.Lock()
+
+
+# Arguments of a ProcessPoolExecutor whose tasks can be cancelled
+def pool_options(context) -> dict:
+    global _flags
+    with _slots_lock:
+        if _flags is None:
+            _flags = context.RawArray("b", REMOTE_SLOTS)
+            _free_slots.extend(range(REMOTE_SLOTS))
+    return {"initializer": _init_pool_process, "initargs": (_flags,)}
+
+
+def _init_pool_process(flags):
+    global _flags
+    _flags = flags
+
+
+class _RemoteToken(CancellationToken):
+    def __init__(self, slot: int, timeout: float):
+        super().__init__(timeout)
+        self.slot = slot
+
+    def check(self):
+        if self.reason is None and _flags[self.slot]:
+            self.reason = REASONS[_flags[self.slot] - 1]
+        super().check()
+
+
+def _run_remote(slot: int, timeout: float, func, *args):
+    with using(_RemoteToken(slot, timeout)):
+        return func(*args)
+
+
+# pool.submit(func, *args), cancelled with the current token. Outside a
+# request, or with every flag taken, the task runs to completion.
+def submit(pool, func, *args) -> concurrent.futures.Future:
+    token = _current.get()
+    slot = None
+    if token is not None and _flags is not None:
+        with _slots_lock:
+            if _free_slots:
+                slot = _free_slots.pop()
+    if slot is None:
+        return pool.submit(func, *args)
+
+    timeout = 0
+    if token.deadline is not None:
+        timeout = max(token.deadline - time.monotonic(), 1e-6)
+    _flags[slot] = 0
+    token.slots.add(slot)
+    future = pool.submit(_run_remote, slot, timeout, func, *args)
+
+    # the flag is only reused once the task is over
+    def release(_):
+        token.slots.discard(slot)
+        _flags[slot] = 0
+        with _slots_lock:
+            _free_slots.append(slot)
+
+    future.add_done_callback(release)
+    if token.reason is not None:
+        token._trip_remote()
+    return future
+
+
+# future.result(), checking the current token while it waits
+def result(future: concurrent.futures.Future):
+    while True:
+        try:
+            return future.result(timeout=POLL_INTERVAL)
+        except concurrent.futures.TimeoutError:
+            try:
+                check()
+            except Cancelled:
+                future.cancel()
+                raise
+
+
+def _timeout(scope) -> float:
+    for name, value in scope.get("headers", []):
+        if name == DEADLINE_HEADER:
+            try:
+                return float(value)
+            except ValueError:
+                break
+    return DEFAULT_REQUEST_TIMEOUT
+
+
+# ASGI middleware that gives every http request a CancellationToken. The
+# request body is read up front and replayed to the app, after which the
+# middleware keeps listening on the connection so an http.disconnect from
+# the client trips the token while the handler is still running.
+class CancellationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = CancellationToken(_timeout(scope))
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body"):
+                break
+
+        disconnected = asyncio.Event()
+        if messages[-1]["type"] == "http.disconnect":
+            token.cancel(CLIENT_DISCONNECTED)
+            disconnected.set()
+
+        async def watch():
+            while not disconnected.is_set():
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    token.cancel(CLIENT_DISCONNECTED)
+                    disconnected.set()
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        watcher = asyncio.ensure_future(watch())
+        reset = _current.set(token)
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            _current.reset(reset)
+            watcher.cancel()
@@ -0,0 +1,136 @@
+import gc
+import math
+import statistics
+import time
+
+import numpy as np
+
+import cancellation
+import kernels
+
+# Empirical complexity of a registered kernel: its time is measured over a
+# geometric size sweep and t = constant * n ** exponent is fitted by least
+# squares on log t = log constant + exponent * log n.
+
+# Points measured faster than this are mostly timer noise and left out of
+# the fit
+MIN_SECONDS = 1e-5
+
+# Below this exponent the time is taken not to grow with the size, mostly
+# call overhead, and no size is predicted
+MIN_EXPONENT = 0.5
+
+# Fits explaining less of the variance than this predict no size
+MIN_R2 = 0.9
+
+# Sizes are only predicted up to this multiple of the largest one measured,
+# further out the fit is a guess
+PREDICT_RANGE = 100
+
+
+def sizes(min_size: int, max_size: int, factor: float):
+    size = min_size
+    while size <= max_size:
+        yield size
+        size = max(int(size * factor), size + 1)
+
+
+def fit(points) -> dict:
+    usable = [(size, seconds) for size, seconds in points if seconds >= MIN_SECONDS]
+    if len(usable) < 2:
+        return None
+    x = np.log([size for size, _ in usable])
+    y = np.log([seconds for _, seconds in usable])
+    exponent, intercept = np.polyfit(x, y, 1)
+    predicted = intercept + exponent * x
+    total = float(np.sum((y - y.mean()) ** 2))
+    residual = float(np.sum((y - predicted) ** 2))
+    return {
+        "exponent": float(exponent),
+        "constant": math.exp(intercept),
+        "r2": 1 - residual / total if total > 0 else 1.0,
+        "points": len(usable),
+    }
+
+
+def predict_time(model: dict, size: int) -> float:
+    return model["constant"] * size ** model["exponent"]
+
+
+# Largest size expected to run within `budget` seconds, None when the time
+# does not grow with the size, the fit is poor or the size would be more
+# than PREDICT_RANGE times `measured`, the largest size measured
+def predict_size(model: dict, budget: float, measured: int) -> int:
+    if model is None or model["exponent"] < MIN_EXPONENT or model["r2"] < MIN_R2:
+        return None
+    log_size = (math.log(budget) - math.log(model["constant"])) / model["exponent"]
+    if log_size > math.log(PREDICT_RANGE * measured):
+        return None
+    return int(math.exp(log_size))
+
+
+# Measures `name` at each size of the sweep (median of `repetitions` calls)
+# until max_size, or until the next size is expected to take the sweep past
+# `max_seconds`, and fits the points. `budget` is the time limit the
+# predicted size is computed for. A collection runs before each size, its
+# time is charged to max_seconds.
+def analyze(
+    name: str,
+    min_size: int,
+    max_size: int,
+    factor: float = 2.0,
+    repetitions: int = 3,
+    budget: float = 1.0,
+    max_seconds: float = 10.0,
+    seed: int = 0,
+) -> dict:
+    points = []
+    model = None
+    started = time.perf_counter()
+    collect_seconds = 0.0
+    stopped = "max_size"
+    # The objects already alive are frozen after one full collection, so
+    # the collection before each size only walks what the sweep allocated
+    gc.collect()
+    gc.freeze()
+    try:
+        for size in sizes(min_size, max_size, factor):
+            cancellation.check()
+            spent = time.perf_counter() - started
+            if points:
+                last_size, last_seconds = points[-1]
+                if model is not None and model["exponent"] >= MIN_EXPONENT:
+                    expected = predict_time(model, size)
+                else:
+                    # not enough points for a fit yet, assume quadratic growth
+                    expected = last_seconds * (size / last_size) ** 2
+                if spent + collect_seconds + expected * repetitions > max_seconds:
+                    stopped = "max_seconds"
+                    break
+            collected = time.perf_counter()
+            gc.collect()
+            collect_seconds = time.perf_counter() - collected
+            seconds = statistics.median(
+                kernels.time_kernel(name, size, seed, collect=False)
+                for _ in range(repetitions)
+            )
+            points.append((size, seconds))
+            model = fit(points)
+    finally:
+        gc.unfreeze()
+
+    return {
+        "kernel": name,
+        "points": [{"size": size, "seconds": seconds} for size, seconds in points],
+        "stopped": stopped,
+        "elapsed": time.perf_counter() - started,
+        "budget": budget,
+        "fit": model,
+        "predicted_size": predict_size(
+            model, budget, max((size for size, _ in points), default=0)
+        ),
+    }
+
+
+# Last report per kernel, read by the apis' prediction gauges
+latest = {}
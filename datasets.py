@@ -0,0 +1,207 @@
+import atexit
+import errno
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Input lists for the sort benchmarks. Each (distribution, size, seed) is
+# generated once and kept in a named shared memory segment as int64, so every
+# uvicorn worker (and every process pool worker) attaches to the same bytes
+# instead of building its own list before each measurement.
+#
+# Segment layout: int64 ready flag, int64 size, then the values. The ready
+# flag is written last so a process attaching while another one is still
+# filling the segment waits for it.
+#
+# /dev/shm is a tmpfs the size of the container's shm_size, shared by every
+# worker. The space of a segment is reserved before it is filled, so a full
+# tmpfs raises DatasetUnavailable instead of killing the process with a
+# SIGBUS on the first write past the limit.
+
+DISTRIBUTIONS = ("uniform", "sorted", "reversed", "few_unique")
+
+# "random" keeps the old behaviour: a fresh unseeded list for every run
+DATASETS = DISTRIBUTIONS + ("random",)
+
+FEW_UNIQUE_VALUES = 8
+
+HEADER = 2
+READY = 1
+WAIT_TIMEOUT = 10.0
+
+
+def _shm_bytes() -> int:
+    try:
+        stat = os.statvfs("/dev/shm")
+    except OSError:
+        return 256 * 1024 * 1024
+    return stat.f_blocks * stat.f_frsize
+
+
+# Segments attached by this process, the least recently used ones are
+# closed and unlinked past this count or past this many bytes (other
+# processes keep their mappings). The defaults follow the size of /dev/shm:
+# half of it per process, and no dataset larger than that.
+MAX_ATTACHED = int(os.getenv("DATASET_CACHE_ENTRIES", 64))
+MAX_BYTES = int(os.getenv("DATASET_CACHE_BYTES", _shm_bytes() // 2))
+MAX_SIZE = int(
+    os.getenv("DATASET_MAX_SIZE", min(10_000_000, MAX_BYTES // 8 - HEADER))
+)
+
+_attached = OrderedDict()
+# Names of the segments this process created, unlinked when it exits
+_owned = set()
+_lock = threading.Lock()
+
+
+class DatasetUnavailable(Exception):
+    pass
+
+
+def segment_name(distribution: str, size: int, seed: int) -> str:
+    return f"ds_{os.getenv('DATASET_NAMESPACE', 'gerencia')}_{distribution}_{size}_{seed}"
+
+
+def generate(distribution: str, size: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if distribution == "few_unique":
+        return rng.integers(1, FEW_UNIQUE_VALUES + 1, size, dtype=np.int64)
+    values = rng.integers(1, size + 1, size, dtype=np.int64)
+    if distribution == "sorted":
+        values.sort()
+    elif distribution == "reversed":
+        values.sort()
+        values = values[::-1]
+    return values
+
+
+def _untrack(segment):
+    # Before python 3.13 every process that attaches registers the segment
+    # with its resource tracker, which unlinks it when that process exits
+    # even if other workers still use it
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+
+
+# Allocates the pages of a new segment up front. SharedMemory only sets its
+# size, the pages would otherwise be allocated by the writes filling it.
+def _reserve(segment, nbytes: int):
+    if not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(segment._fd, 0, nbytes)
+    except OSError as error:
+        if error.errno == errno.ENOSPC:
+            raise DatasetUnavailable(
+                f"No room left in shared memory for {nbytes} bytes of dataset"
+            )
+        # other errors mean the filesystem cannot reserve, fill it as is
+
+
+def _open(distribution: str, size: int, seed: int):
+    name = segment_name(distribution, size, seed)
+    nbytes = 8 * (HEADER + size)
+    try:
+        segment = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        _untrack(segment)
+        try:
+            _reserve(segment, nbytes)
+            buffer = np.ndarray((HEADER + size,), dtype=np.int64, buffer=segment.buf)
+            buffer[1] = size
+            buffer[HEADER:] = generate(distribution, size, seed)
+            buffer[0] = READY
+        except BaseException:
+            _unlink(segment)
+            raise
+        _owned.add(name)
+    except FileExistsError:
+        segment = shared_memory.SharedMemory(name=name)
+        _untrack(segment)
+        buffer = np.ndarray((HEADER + size,), dtype=np.int64, buffer=segment.buf)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while buffer[0] != READY:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Dataset {name} was never filled")
+            time.sleep(0.001)
+    values = buffer[HEADER:]
+    values.flags.writeable = False
+    return segment, values
+
+
+def _unlink(segment):
+    # unlink() also unregisters the segment from the resource tracker, which
+    # complains as _untrack already did
+    resource_tracker.register(segment._name, "shared_memory")
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        resource_tracker.unregister(segment._name, "shared_memory")
+
+
+def _close(segment, unlink: bool = True):
+    if unlink:
+        _owned.discard(segment.name)
+        _unlink(segment)
+    try:
+        segment.close()
+    except BufferError:
+        # a caller still holds a view, the mapping goes with it
+        pass
+
+
+# Drops the least recently used segments until one of nbytes fits in the
+# budget
+def _evict(nbytes: int):
+    while _attached and (
+        len(_attached) >= MAX_ATTACHED
+        or sum(segment.size for segment, _ in _attached.values()) + nbytes
+        > MAX_BYTES
+    ):
+        _, (segment, values) = _attached.popitem(last=False)
+        del values
+        _close(segment)
+
+
+# Read only int64 view of the dataset, generated on first use by any
+# process. Raises DatasetUnavailable when shared memory is full.
+def get(distribution: str, size: int, seed: int = 0) -> np.ndarray:
+    if distribution == "random":
+        return np.random.default_rng().integers(1, size + 1, size, dtype=np.int64)
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown dataset {distribution}, choose from {DATASETS}")
+    if size > MAX_SIZE:
+        raise ValueError(f"Dataset size {size} is above the limit of {MAX_SIZE}")
+    key = (distribution, size, seed)
+    with _lock:
+        entry = _attached.get(key)
+        if entry is None:
+            _evict(8 * (HEADER + size))
+            try:
+                entry = _open(distribution, size, seed)
+            except DatasetUnavailable:
+                # the rest of /dev/shm is held by other processes, give it
+                # the whole budget of this one and try once more
+                _evict(MAX_BYTES)
+                entry = _open(distribution, size, seed)
+            _attached[key] = entry
+        else:
+            _attached.move_to_end(key)
+        return entry[1]
+
+
+# Closes every segment and unlinks the ones this process created, so they
+# do not outlive it in /dev/shm. Run at exit by the workers and by the
+# process pool.
+@atexit.register
+def release():
+    with _lock:
+        while _attached:
+            _, (segment, values) = _attached.popitem()
+            del values
+            _close(segment, unlink=segment.name in _owned)
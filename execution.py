@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cancellation
+
+# How an api runs its workloads, EXECUTION_ENGINE:
+#   threadpool - sync handlers on FastAPI's threadpool, the default of api1
+#   asyncio    - async handlers that hand the workload to a pool of
+#                EXECUTOR_WORKERS threads and await it, the default of api2
+#   process    - as asyncio, with the CPU bound kernels run on a pool of
+#                EXECUTOR_WORKERS processes, in parallel on every core
+#   inline     - async handlers running the workload on the event loop
+# The workloads are the same code under every engine, only where they run
+# changes. EXECUTOR_MODE (thread, process, inline) is still read when
+# EXECUTION_ENGINE is not set.
+ENGINES = ("threadpool", "asyncio", "process", "inline")
+_EXECUTOR_MODES = {"thread": "asyncio", "process": "process", "inline": "inline"}
+
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", os.cpu_count() or 1))
+
+ENGINE = None
+
+_threads = None
+_processes = None
+
+
+def engine_from_env(default: str) -> str:
+    engine = os.getenv("EXECUTION_ENGINE")
+    if not engine and os.getenv("EXECUTOR_MODE"):
+        engine = _EXECUTOR_MODES.get(os.environ["EXECUTOR_MODE"])
+    engine = engine or default
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown execution engine {engine}, choose from {ENGINES}")
+    return engine
+
+
+def configure(engine: str):
+    global ENGINE
+    ENGINE = engine
+
+
+def get_threads() -> ThreadPoolExecutor:
+    global _threads
+    if _threads is None:
+        _threads = ThreadPoolExecutor(
+            max_workers=EXECUTOR_WORKERS, thread_name_prefix="cpu"
+        )
+    return _threads
+
+
+def get_processes() -> ProcessPoolExecutor:
+    global _processes
+    if _processes is None:
+        context = multiprocessing.get_context("spawn")
+        _processes = ProcessPoolExecutor(
+            max_workers=EXECUTOR_WORKERS,
+            mp_context=context,
+            **cancellation.pool_options(context),
+        )
+    return _processes
+
+
+# Runs a CPU bound kernel, func(*args). Under the process engine it runs on
+# the process pool while the calling thread waits; func and its arguments
+# must then be picklable. A cancelled request stops the kernel in the pool
+# process too (see cancellation.submit). Spans are opened by the caller, so
+# the trace tree is the same under every engine.
+def call(func, *args):
+    if ENGINE != "process":
+        return func(*args)
+    return cancellation.result(cancellation.submit(get_processes(), func, *args))
+
+
+# The handler FastAPI serves for the sync workload `func` under the
+# configured engine, with the same signature so the query parameters are
+# unchanged. The context is carried over to the pool thread, so the spans
+# the workload starts nest under the request's and cancellation still
+# reaches it.
+def handler(func):
+    if ENGINE == "threadpool":
+        return func
+
+    async def run(*args, **kwargs):
+        if ENGINE == "inline":
+            return func(*args, **kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_threads(), lambda: context.run(func, *args, **kwargs)
+        )
+
+    run.__name__ = func.__name__
+    run.__doc__ = func.__doc__
+    run.__signature__ = inspect.signature(func)
+    return run
+
+
+def shutdown():
+    global _threads, _processes
+    for executor in (_threads, _processes):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    _threads = None
+    _processes = None
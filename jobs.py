@@ -0,0 +1,214 @@
+import inspect
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import pydantic
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+
+import cancellation
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", 16))
+# Finished jobs kept for GET /jobs/{id}, the oldest are forgotten first
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 1000))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+tracer = trace.get_tracer("api.tracer")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, workload: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.workload = workload
+        self.params = params
+        self.status = QUEUED
+        self.cancel_requested = False
+        # set once the job runs, DELETE trips it to stop the workload
+        self.token = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # trace context of the request that submitted the job
+        self.context = otel_context.get_current()
+
+    def describe(self) -> dict:
+        description = {
+            "id": self.id,
+            "workload": self.workload,
+            "params": self.params,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.started_at is not None:
+            description["wait_time"] = self.started_at - self.submitted_at
+        if self.finished_at is not None and self.started_at is not None:
+            description["run_time"] = self.finished_at - self.started_at
+        if self.status == SUCCEEDED:
+            description["result"] = self.result
+        if self.status == FAILED:
+            description["error"] = self.error
+        return description
+
+
+# Builds a pydantic model out of an endpoint's Query(...) parameters, so a
+# job is validated against the same defaults and constraints as the GET
+# endpoint it runs. Parameters in `exclude` are left out of the model.
+def params_model(name: str, endpoint, exclude=()):
+    fields = {
+        parameter.name: (parameter.annotation, parameter.default)
+        for parameter in inspect.signature(endpoint).parameters.values()
+        if parameter.name not in exclude
+    }
+    return pydantic.create_model(f"{name}_params", **fields)
+
+
+# Runs registered workloads on a fixed number of threads fed by a bounded
+# queue. A submission that finds the queue full is refused instead of
+# piling up behind the running jobs. A cancelled job leaves the queue right
+# away, so the depth is always the number of queued jobs.
+class JobManager:
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        depth: int = JOB_QUEUE_DEPTH,
+        retention: int = JOB_RETENTION,
+        wait_histogram=None,
+        run_histogram=None,
+    ):
+        self.workers = workers
+        self.retention = retention
+        self.depth = depth
+        self.queue = deque()
+        self.jobs = OrderedDict()
+        self.workloads = {}
+        self.lock = threading.Lock()
+        self.queued = threading.Condition(self.lock)
+        self.wait_histogram = wait_histogram
+        self.run_histogram = run_histogram
+        self.threads = []
+
+    # `fixed` parameters are always passed to the endpoint and cannot be set
+    # by the submitter, e.g. to turn off a streamed response
+    def register(self, name: str, endpoint, **fixed):
+        self.workloads[name] = (endpoint, params_model(name, endpoint, fixed), fixed)
+
+    def start(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name=f"job-{len(self.threads)}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    # Raises KeyError for an unknown workload, pydantic.ValidationError for
+    # bad parameters and QueueFull when the queue is at its depth
+    def submit(self, workload: str, params: dict) -> Job:
+        endpoint, model, _ = self.workloads[workload]
+        job = Job(workload, model(**params).model_dump())
+        with self.lock:
+            if len(self.queue) >= self.depth:
+                raise QueueFull(f"Job queue is full ({self.depth} jobs)")
+            self.queue.append(job)
+            self.queued.notify()
+            self.jobs[job.id] = job
+            self._forget()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs.get(job_id)
+
+    # Queued jobs are dropped right away, running ones stop at the next
+    # cancellation check of their workload
+    def cancel(self, job_id: str) -> Job:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.cancel_requested = True
+            if job.status == QUEUED:
+                self.queue.remove(job)
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            else:
+                job.token.cancel(cancellation.JOB_CANCELLED)
+            return job
+
+    def queue_length(self) -> int:
+        return len(self.queue)
+
+    def _forget(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[: max(len(self.jobs) - self.retention, 0)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self.queued:
+                while not self.queue:
+                    self.queued.wait()
+                # popped and marked running at once, cancel() sees one or
+                # the other
+                job = self.queue.popleft()
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.token = cancellation.CancellationToken()
+            self._run(job)
+
+    def _run(self, job: Job):
+        attributes = {"workload": job.workload}
+        if self.wait_histogram is not None:
+            self.wait_histogram.record(job.started_at - job.submitted_at, attributes)
+
+        endpoint, _, fixed = self.workloads[job.workload]
+        token = otel_context.attach(job.context)
+        try:
+            with tracer.start_as_current_span("job") as span:
+                span.set_attribute("job_id", job.id)
+                span.set_attribute("workload", job.workload)
+                span.set_attribute("wait_time", job.started_at - job.submitted_at)
+                try:
+                    with cancellation.using(job.token):
+                        result = endpoint(**job.params, **fixed)
+                    status = CANCELLED if job.cancel_requested else SUCCEEDED
+                except cancellation.Cancelled as cancelled:
+                    span.record_exception(cancelled)
+                    span.set_status(Status(StatusCode.ERROR, cancelled.reason))
+                    result = None
+                    status = CANCELLED
+                except Exception as error:
+                    span.record_exception(error)
+                    result = None
+                    status = FAILED
+                    job.error = repr(error)
+                span.set_attribute("status", status)
+        finally:
+            otel_context.detach(token)
+
+        with self.lock:
+            job.result = result
+            job.status = status
+            job.finished_at = time.time()
+        if self.run_histogram is not None:
+            self.run_histogram.record(
+                job.finished_at - job.started_at, {**attributes, "status": status}
+            )
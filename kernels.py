@@ -0,0 +1,611 @@
+import gc
+import random
+import time
+from array import array
+
+import numpy as np
+
+import cancellation
+import datasets
+import montecarlo
+
+# Workloads without any tracing, so they can be shipped to a process pool.
+# The long loops call cancellation.check() every so often so the work stops
+# when the request it belongs to is abandoned.
+
+# Inner loops check for cancellation once every CHECK_MASK + 1 iterations
+CHECK_MASK = 0x3FF
+SUM_CHUNK = 1 << 20
+
+
+# The list sorts below work in place on the list they are given (mergeSort
+# returns a new one) and return the sorted list.
+
+
+def bubble_sort(bubbleList):
+    n = len(bubbleList)
+    for i in range(n):
+        cancellation.check()
+        for j in range(0, n - i - 1):
+            if bubbleList[j] < bubbleList[j + 1]:
+                bubbleList[j], bubbleList[j + 1] = bubbleList[j + 1], bubbleList[j]
+    return bubbleList
+
+
+# Bubble sort that stops as soon as a pass makes no swap and does not look
+# past the last swap of the previous pass
+def bubble_sort_early_exit(values):
+    end = len(values) - 1
+    while end > 0:
+        cancellation.check()
+        last_swap = 0
+        for j in range(end):
+            if values[j] > values[j + 1]:
+                values[j], values[j + 1] = values[j + 1], values[j]
+                last_swap = j
+        end = last_swap
+    return values
+
+
+def selection_sort(selectionList):
+    n = len(selectionList)
+    for i in range(n):
+        cancellation.check()
+        smallest_index = i
+        for j in range(i + 1, n):
+            if selectionList[j] < selectionList[smallest_index]:
+                smallest_index = j
+        selectionList[i], selectionList[smallest_index] = (
+            selectionList[smallest_index],
+            selectionList[i],
+        )
+    return selectionList
+
+
+def insertion_sort(values, start: int = 0, end: int = None):
+    if end is None:
+        end = len(values)
+    for i in range(start + 1, end):
+        if i & CHECK_MASK == 0:
+            cancellation.check()
+        current = values[i]
+        j = i - 1
+        while j >= start and values[j] > current:
+            values[j + 1] = values[j]
+            j -= 1
+        values[j + 1] = current
+    return values
+
+
+def _sift_down(values, root: int, end: int):
+    current = values[root]
+    child = 2 * root + 1
+    while child < end:
+        if child + 1 < end and values[child + 1] > values[child]:
+            child += 1
+        if values[child] <= current:
+            break
+        values[root] = values[child]
+        root = child
+        child = 2 * root + 1
+    values[root] = current
+
+
+def heap_sort(values):
+    n = len(values)
+    for root in range(n // 2 - 1, -1, -1):
+        _sift_down(values, root, n)
+    for end in range(n - 1, 0, -1):
+        if end & CHECK_MASK == 0:
+            cancellation.check()
+        values[0], values[end] = values[end], values[0]
+        _sift_down(values, 0, end)
+    return values
+
+
+# In place quicksort with a median of three pivot and a three way partition,
+# so lists with many repeated values do not degrade to O(n^2). The smaller
+# side is handled first on an explicit stack to bound its depth and small
+# ranges are left to insertion sort.
+def quick_sort(values):
+    stack = [(0, len(values) - 1)]
+    while stack:
+        cancellation.check()
+        low, high = stack.pop()
+        if high - low < 16:
+            insertion_sort(values, low, high + 1)
+            continue
+        middle = (low + high) // 2
+        pivot = sorted((values[low], values[middle], values[high]))[1]
+        lt, i, gt = low, low, high
+        while i <= gt:
+            if values[i] < pivot:
+                values[lt], values[i] = values[i], values[lt]
+                lt += 1
+                i += 1
+            elif values[i] > pivot:
+                values[gt], values[i] = values[i], values[gt]
+                gt -= 1
+            else:
+                i += 1
+        if lt - low < high - gt:
+            stack.append((gt + 1, high))
+            stack.append((low, lt - 1))
+        else:
+            stack.append((low, lt - 1))
+            stack.append((gt + 1, high))
+    return values
+
+
+def mergeSort(randomList):
+    mergeList = list(randomList)
+
+    if len(mergeList) <= 1:
+        return mergeList
+
+    middle = int(len(mergeList) / 2)
+    left = mergeSort(mergeList[:middle])
+    right = mergeSort(mergeList[middle:])
+
+    return merge(left, right)
+
+
+def merge(left, right):
+    result = []
+    i = j = 0
+
+    while i < len(left) and j < len(right):
+        if left[i] < right[j]:
+            result.append(left[i])
+            i = i + 1
+        else:
+            result.append(right[j])
+            j = j + 1
+
+    result.extend(left[i:])
+    result.extend(right[j:])
+
+    return result
+
+
+# Runs shorter than this are sorted with insertion sort before merging
+MIN_RUN = 32
+
+
+# Iterative merge sort. Runs of MIN_RUN items are insertion sorted in place,
+# then merged pairwise back and forth between two buffers allocated once,
+# doubling the run width on every pass. With buffer="array" both buffers are
+# array('q') so the items are unboxed int64 instead of pointers to int
+# objects. The result is written back into values.
+def merge_sort_bottom_up(values, buffer: str = "list"):
+    n = len(values)
+    if n < 2:
+        return values
+    if buffer == "array":
+        source = array("q", values)
+        target = array("q", bytes(8 * n))
+    else:
+        source = values
+        target = [0] * n
+
+    for low in range(0, n, MIN_RUN):
+        insertion_sort(source, low, min(low + MIN_RUN, n))
+
+    width = MIN_RUN
+    while width < n:
+        cancellation.check()
+        step = 2 * width
+        for low in range(0, n, step):
+            middle = low + width
+            if middle >= n:
+                target[low:n] = source[low:n]
+                continue
+            high = middle + width
+            if high > n:
+                high = n
+            i, j, k = low, middle, low
+            left = source[i]
+            right = source[j]
+            while True:
+                if right < left:
+                    target[k] = right
+                    k += 1
+                    j += 1
+                    if j == high:
+                        break
+                    right = source[j]
+                else:
+                    target[k] = left
+                    k += 1
+                    i += 1
+                    if i == middle:
+                        break
+                    left = source[i]
+            if i < middle:
+                target[k:high] = source[i:middle]
+            else:
+                target[k:high] = source[j:high]
+        source, target = target, source
+        width = step
+
+    if source is not values:
+        values[:] = source
+    return values
+
+
+def merge_sort_array(values):
+    return merge_sort_bottom_up(values, "array")
+
+
+# LSD radix sort on bytes, for integers (negative values are offset by the
+# minimum)
+def radix_sort(values):
+    if not values:
+        return values
+    offset = min(values)
+    keys = [value - offset for value in values]
+    largest = max(keys)
+    shift = 0
+    while (largest >> shift) > 0:
+        buckets = [[] for _ in range(256)]
+        for key in keys:
+            buckets[(key >> shift) & 0xFF].append(key)
+        keys = [key for bucket in buckets for key in bucket]
+        shift += 8
+    values[:] = [key + offset for key in keys]
+    return values
+
+
+def timsort(values):
+    values.sort()
+    return values
+
+
+def numpy_sort(kind: str):
+    def sort(values):
+        return np.sort(values, kind=kind)
+
+    sort.__name__ = f"numpy_{kind}"
+    return sort
+
+
+# Python ints for the list sorts, numpy scalars would make every comparison
+# several times slower
+def to_list(values):
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return list(values)
+
+
+def to_int64_array(values):
+    return np.array(values, dtype=np.int64)
+
+
+# Registry of the algorithms /sort can compare: name -> (prepare, sort,
+# descending). prepare builds the sort's input from the generated list and is
+# not timed, descending is the order the sort produces.
+SORTS = {
+    "bubble": (to_list, bubble_sort, True),
+    "bubble_early_exit": (to_list, bubble_sort_early_exit, False),
+    "selection": (to_list, selection_sort, False),
+    "insertion": (to_list, insertion_sort, False),
+    "heap": (to_list, heap_sort, False),
+    "quick": (to_list, quick_sort, False),
+    "merge": (to_list, merge_sort_bottom_up, False),
+    "merge_array": (to_list, merge_sort_array, False),
+    "merge_recursive": (to_list, mergeSort, False),
+    "radix": (to_list, radix_sort, False),
+    "timsort": (to_list, timsort, False),
+    "numpy_quicksort": (to_int64_array, numpy_sort("quicksort"), False),
+    "numpy_mergesort": (to_int64_array, numpy_sort("mergesort"), False),
+    "numpy_heapsort": (to_int64_array, numpy_sort("heapsort"), False),
+}
+
+DEFAULT_SORTS = "bubble,selection,merge"
+
+
+# Splits a comma separated list of names, raising ValueError on ones that
+# are not in `choices`
+def parse_names(names: str, choices, kind: str):
+    selected = [name.strip() for name in names.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in choices]
+    if unknown:
+        raise ValueError(f"Unknown {kind} {unknown}, choose from {list(choices)}")
+    return selected
+
+
+def parse_sorts(names: str):
+    return parse_names(names, SORTS, "sort algorithms")
+
+
+def is_sorted(values, descending: bool = False) -> bool:
+    if descending:
+        return all(a >= b for a, b in zip(values, values[1:]))
+    return all(a <= b for a, b in zip(values, values[1:]))
+
+
+# Time spent sorting, measured where the sort runs so queueing and
+# serialization around an executor are not counted. The result is checked
+# after the clock stops.
+def timed_sort(name: str, randomList) -> float:
+    prepare, sort, descending = SORTS[name]
+    values = prepare(randomList)
+    initial_time = time.time()
+    result = sort(values)
+    total_time = time.time() - initial_time
+    if len(result) != len(randomList) or not is_sorted(result, descending):
+        raise RuntimeError(f"Sort algorithm {name} returned an unsorted list")
+    return total_time
+
+
+# Same as timed_sort on a pregenerated dataset, the process running the sort
+# attaches to the shared segment instead of receiving a copy of the list
+def timed_sort_dataset(name: str, distribution: str, size: int, seed: int) -> float:
+    return timed_sort(name, datasets.get(distribution, size, seed))
+
+
+INT64_MAX = int(np.iinfo(np.int64).max)
+
+
+def _sum_chunk_builtin(start: int, stop: int) -> int:
+    return sum(range(start, stop))
+
+
+def _sum_chunk_loop(start: int, stop: int) -> int:
+    result = 0
+    for i in range(start, stop):
+        result += i
+    return result
+
+
+# The exact chunk sum is known up front, so a chunk whose values or sum do
+# not fit in an int64 is added with python ints instead of wrapping around
+def _sum_chunk_numpy(start: int, stop: int) -> int:
+    if stop - 1 > INT64_MAX or (start + stop - 1) * (stop - start) // 2 > INT64_MAX:
+        return _sum_chunk_builtin(start, stop)
+    return int(np.arange(start, stop, dtype=np.int64).sum())
+
+
+SUM_KERNELS = {
+    "builtin": _sum_chunk_builtin,
+    "loop": _sum_chunk_loop,
+    "numpy": _sum_chunk_numpy,
+}
+
+
+# Sums start..stop-1 SUM_CHUNK numbers at a time. With a deadline (wall
+# clock, so it can be shared with pool processes) the sum stops after the
+# first chunk that ends past it. Returns the sum and how many numbers it
+# covers.
+def sum_range(kernel: str, start: int, stop: int, deadline: float = None):
+    add = SUM_KERNELS[kernel]
+    result = 0
+    position = start
+    while position < stop:
+        cancellation.check()
+        end = min(position + SUM_CHUNK, stop)
+        result += add(position, end)
+        position = end
+        if deadline is not None and time.time() >= deadline:
+            break
+    return result, position - start
+
+
+def sum_builtin(target: int) -> int:
+    return sum_range("builtin", 0, target + 1)[0]
+
+
+def sum_formula(target: int) -> int:
+    return target * (target + 1) // 2
+
+
+def sum_loop(target: int) -> int:
+    return sum_range("loop", 0, target + 1)[0]
+
+
+def sum_numpy(target: int) -> int:
+    return sum_range("numpy", 0, target + 1)[0]
+
+
+# Ways /sum-of-n-numbers can compute 0 + 1 + ... + target: the chunked
+# kernels above, the closed formula, and the builtin kernel split over a
+# process pool
+SUM_METHODS = ("builtin", "formula", "loop", "numpy", "parallel")
+
+DEFAULT_SUM_METHODS = "builtin,formula,loop"
+
+# Names the original three methods had, kept as their metric and span
+# labels and response keys (method_1_result, ...)
+SUM_METHOD_LABELS = {"builtin": "method_1", "formula": "method_2", "loop": "method_3"}
+
+
+def parse_sum_methods(names: str):
+    return parse_names(names, SUM_METHODS, "sum methods")
+
+
+# Splits 0..target into one contiguous range per worker and sums them on
+# `pool`. Returns one future per range, each resolving to sum_range's
+# (sum, numbers covered).
+def submit_sum_parallel(
+    pool, target: int, workers: int, kernel: str = "builtin", deadline: float = None
+):
+    share, rest = divmod(target + 1, workers)
+    futures = []
+    start = 0
+    for i in range(workers):
+        stop = start + share + (1 if i < rest else 0)
+        if stop > start:
+            futures.append(
+                cancellation.submit(pool, sum_range, kernel, start, stop, deadline)
+            )
+        start = stop
+    return futures
+
+
+# Both object churn kernels return the size of the list holding the objects
+def create_objects_comprehension(count: int) -> int:
+    objects = build_comprehension(count)
+    size = objects.__sizeof__()
+    del objects
+    return size
+
+
+def create_objects_append(count: int) -> int:
+    objects = build_append(count)
+    size = objects.__sizeof__()
+    del objects
+    return size
+
+
+# Ways of holding `count` objects, compared by /object-creation-deletion. The
+# first three hold bare object() instances as the original two methods did,
+# the others hold the same (id, value) record in more and more compact forms.
+class Record:
+    def __init__(self, id: int, value: int):
+        self.id = id
+        self.value = value
+
+
+class SlotsRecord:
+    __slots__ = ("id", "value")
+
+    def __init__(self, id: int, value: int):
+        self.id = id
+        self.value = value
+
+
+RECORD_DTYPE = np.dtype([("id", np.int64), ("value", np.int64)])
+
+
+def build_comprehension(count: int):
+    return [object() for _ in range(count)]
+
+
+def build_append(count: int):
+    objects = []
+    for i in range(count):
+        if i & CHECK_MASK == 0:
+            cancellation.check()
+        objects.append(object())
+    return objects
+
+
+def build_preallocated(count: int):
+    objects = [None] * count
+    for i in range(count):
+        if i & CHECK_MASK == 0:
+            cancellation.check()
+        objects[i] = object()
+    return objects
+
+
+def build_class(count: int):
+    return [Record(i, i) for i in range(count)]
+
+
+def build_slots(count: int):
+    return [SlotsRecord(i, i) for i in range(count)]
+
+
+def build_tuple(count: int):
+    return [(i, i) for i in range(count)]
+
+
+def build_array(count: int):
+    values = array("q", [0]) * (2 * count)
+    for i in range(count):
+        if i & CHECK_MASK == 0:
+            cancellation.check()
+        values[2 * i] = i
+        values[2 * i + 1] = i
+    return values
+
+
+def build_numpy_structured(count: int):
+    records = np.empty(count, dtype=RECORD_DTYPE)
+    records["id"] = np.arange(count)
+    records["value"] = records["id"]
+    return records
+
+
+OBJECT_STRATEGIES = {
+    "comprehension": build_comprehension,
+    "append": build_append,
+    "preallocated": build_preallocated,
+    "class": build_class,
+    "slots": build_slots,
+    "tuple": build_tuple,
+    "array": build_array,
+    "numpy_structured": build_numpy_structured,
+}
+
+DEFAULT_OBJECT_STRATEGIES = "comprehension,append"
+
+# Response keys and messages the original two methods had, still returned
+# for the strategies that replaced them
+OBJECT_RESULTS = {
+    "comprehension": ("method_1_result", "Method 1 completed"),
+    "append": ("method_2_result", "Method 2 completed"),
+}
+
+
+def parse_object_strategies(names: str):
+    return parse_names(names, OBJECT_STRATEGIES, "object strategies")
+
+
+def _sort_setup(name: str):
+    prepare = SORTS[name][0]
+    return lambda size, seed: (prepare(datasets.generate("uniform", size, seed)),)
+
+
+def _pi_python(samples: int, rng):
+    return montecarlo.pi_python(samples=samples, rng=rng)
+
+
+def _pi_numpy(samples: int, rng):
+    return montecarlo.pi_numpy(samples=samples, rng=rng)
+
+
+def _size_only(size: int, seed: int):
+    return (size,)
+
+
+# Registry of the kernels that can be timed on their own, by bench.py and
+# /complexity: name -> (setup, kernel). setup(size, seed) builds the kernel's
+# arguments outside the timed region, so in place sorts always get unsorted
+# input. size is the list length, the number of pi samples, the sum target
+# or the object count.
+KERNELS = {
+    **{
+        f"sort_{name}": (_sort_setup(name), sort)
+        for name, (_, sort, _) in SORTS.items()
+    },
+    "pi_python": (lambda size, seed: (size, random.Random(seed)), _pi_python),
+    "pi_numpy": (lambda size, seed: (size, np.random.default_rng(seed)), _pi_numpy),
+    "sum_builtin": (_size_only, sum_builtin),
+    "sum_formula": (_size_only, sum_formula),
+    "sum_loop": (_size_only, sum_loop),
+    "sum_numpy": (_size_only, sum_numpy),
+    "create_objects_comprehension": (_size_only, create_objects_comprehension),
+    "create_objects_append": (_size_only, create_objects_append),
+}
+
+
+def parse_kernel(name: str) -> str:
+    name = name.strip()
+    if name not in KERNELS:
+        raise ValueError(f"Unknown kernel {name!r}, choose from {list(KERNELS)}")
+    return name
+
+
+# Seconds one call of a registered kernel takes on input of the given size,
+# by default after a full collection so the garbage of a previous call is
+# not charged to it
+def time_kernel(name: str, size: int, seed: int = 0, collect: bool = True) -> float:
+    setup, kernel = KERNELS[name]
+    args = setup(size, seed)
+    if collect:
+        gc.collect()
+    start = time.perf_counter_ns()
+    kernel(*args)
+    return (time.perf_counter_ns() - start) / 1e9
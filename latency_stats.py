@@ -0,0 +1,167 @@
+import math
+import threading
+from collections import OrderedDict
+
+# Explicit bucket boundaries (seconds) for the exported rtt histograms, from
+# sub millisecond loopback/LAN round trips up to the 2 s probe timeout
+RTT_BUCKETS = [
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.15,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    1.5,
+    2.0,
+]
+
+PERCENTILES = (50, 90, 99)
+
+# Hosts are user supplied, keep only the most recently probed ones
+MAX_HOSTS = 256
+
+
+# Streaming histogram with logarithmic buckets (HDR style): every bucket is
+# `precision` wider than the previous one, so any recorded value is reported
+# back within that relative error whatever its magnitude. Memory only
+# depends on the range, not on the number of values recorded.
+class LogHistogram:
+    def __init__(self, lowest: float = 1e-6, precision: float = 0.01):
+        self.lowest = lowest
+        self.log_base = math.log1p(precision)
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.lock = threading.Lock()
+
+    def _index(self, value: float) -> int:
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self.log_base) + 1
+
+    def _value(self, index: int) -> float:
+        if index == 0:
+            return self.lowest
+        # midpoint of the bucket
+        return self.lowest * math.exp((index - 0.5) * self.log_base)
+
+    def record(self, value: float):
+        index = self._index(value)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percentile: float) -> float:
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = max(1, math.ceil(percentile / 100 * self.count))
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(max(self._value(index), self.min), self.max)
+            return self.max
+
+    def summary(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        summary = {"count": self.count, "min": self.min}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+        summary["max"] = self.max
+        summary["mean"] = self.total / self.count
+        return summary
+
+
+# Mean absolute difference between consecutive rtts, lost probes are skipped
+def jitter(rtts) -> float:
+    received = [rtt for rtt in rtts if rtt is not None]
+    if len(received) < 2:
+        return 0.0
+    return sum(abs(b - a) for a, b in zip(received, received[1:])) / (
+        len(received) - 1
+    )
+
+
+# Cumulative statistics for one probed host
+class HostStats:
+    def __init__(self):
+        self.histogram = LogHistogram()
+        self.sent = 0
+        self.lost = 0
+        self.jitter_total = 0.0
+        self.jitter_count = 0
+        self.last_rtt = None
+        self.lock = threading.Lock()
+
+    def record(self, rtts):
+        for rtt in rtts:
+            if rtt is not None:
+                self.histogram.record(rtt)
+        with self.lock:
+            self.sent += len(rtts)
+            for rtt in rtts:
+                if rtt is None:
+                    self.lost += 1
+                    continue
+                if self.last_rtt is not None:
+                    self.jitter_total += abs(rtt - self.last_rtt)
+                    self.jitter_count += 1
+                self.last_rtt = rtt
+
+    def summary(self) -> dict:
+        summary = self.histogram.summary()
+        summary["sent"] = self.sent
+        summary["loss_percent"] = 100 * self.lost / self.sent if self.sent else 0.0
+        summary["jitter"] = (
+            self.jitter_total / self.jitter_count if self.jitter_count else 0.0
+        )
+        return summary
+
+
+_hosts = OrderedDict()
+_hosts_lock = threading.Lock()
+
+
+def host_stats(host: str) -> HostStats:
+    with _hosts_lock:
+        stats = _hosts.get(host)
+        if stats is None:
+            stats = _hosts[host] = HostStats()
+            if len(_hosts) > MAX_HOSTS:
+                _hosts.popitem(last=False)
+        else:
+            _hosts.move_to_end(host)
+        return stats
+
+
+# Statistics of a single /latency run, in probe order
+def summarize(rtts) -> dict:
+    histogram = LogHistogram()
+    for rtt in rtts:
+        if rtt is not None:
+            histogram.record(rtt)
+    summary = histogram.summary()
+    lost = sum(1 for rtt in rtts if rtt is None)
+    summary["sent"] = len(rtts)
+    summary["loss_percent"] = 100 * lost / len(rtts) if rtts else 0.0
+    summary["jitter"] = jitter(rtts)
+    return summary
@@ -0,0 +1,132 @@
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+import kernels
+
+# Memory profile of one object strategy. By default the objects are built
+# once and only the allocation is timed, so the endpoint stays cheap enough
+# to load test. A detailed run also watches RSS and the garbage collector
+# while timing, then builds the objects again under tracemalloc, which slows
+# allocation several times over but accounts every byte Python allocates.
+# tracemalloc, the gc callbacks and RSS are process wide, so detailed runs
+# are serialized.
+
+_lock = threading.Lock()
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+
+# Resident set size in bytes, None where /proc is not available
+def rss() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _delta(after, before):
+    if after is None or before is None:
+        return None
+    return after - before
+
+
+# Collections per generation and time spent in the collector, from the
+# moment it is created until stop()
+class GcMonitor:
+    def __init__(self):
+        self.collections = [0] * len(gc.get_count())
+        self.collected = 0
+        self.seconds = 0.0
+        self.started = None
+        gc.callbacks.append(self._callback)
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.seconds += time.perf_counter() - self.started
+            self.collections[info["generation"]] += 1
+            self.collected += info["collected"]
+            self.started = None
+
+    def stop(self) -> dict:
+        gc.callbacks.remove(self._callback)
+        return {
+            "collections": self.collections,
+            "collected": self.collected,
+            "seconds": self.seconds,
+        }
+
+
+def _timed(build, count: int, watch: bool = False) -> dict:
+    if watch:
+        gc.collect()
+        rss_before = rss()
+        monitor = GcMonitor()
+    try:
+        start = time.perf_counter()
+        objects = build(count)
+        build_seconds = time.perf_counter() - start
+        rss_held = rss() if watch else None
+        container_size = objects.__sizeof__()
+        start = time.perf_counter()
+        del objects
+        delete_seconds = time.perf_counter() - start
+    finally:
+        if watch:
+            gc_stats = monitor.stop()
+    report = {
+        "build_seconds": build_seconds,
+        "delete_seconds": delete_seconds,
+        "objects_per_second": count / build_seconds if build_seconds > 0 else None,
+        "container_size": container_size,
+    }
+    if watch:
+        report["rss_delta"] = _delta(rss_held, rss_before)
+        report["rss_net"] = _delta(rss(), rss_before)
+        report["gc"] = gc_stats
+    return report
+
+
+def _traced(build, count: int) -> dict:
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        objects = build(count)
+        held, _ = tracemalloc.get_traced_memory()
+        del objects
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return {
+        "held": held - before,
+        "peak": peak - before,
+        "net": after - before,
+        "bytes_per_object": (held - before) / count,
+    }
+
+
+def profile(strategy: str, count: int, detail: bool = False) -> dict:
+    build = kernels.OBJECT_STRATEGIES[strategy]
+    report = {"strategy": strategy, "count": count}
+    if not detail:
+        report.update(_timed(build, count))
+        return report
+    with _lock:
+        report.update(_timed(build, count, watch=True))
+        report["tracemalloc"] = _traced(build, count)
+    report["bytes_per_object"] = report["tracemalloc"]["bytes_per_object"]
+    return report
@@ -0,0 +1,265 @@
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+from opentelemetry import metrics
+from opentelemetry.exporter.otlp.proto.http.metric_exporter import \
+    OTLPMetricExporter
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import (Gauge, Histogram,
+                                              InMemoryMetricReader,
+                                              PeriodicExportingMetricReader,
+                                              Sum)
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import (CounterMetricFamily, GaugeMetricFamily,
+                                    HistogramMetricFamily)
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+
+# Metrics export of both apis, from the environment:
+#   METRICS_MODE              - "otlp" pushes to the collector every
+#                               METRICS_EXPORT_INTERVAL_MS (the api's own
+#                               default when unset), "prometheus" serves
+#                               them at /metrics, collected at scrape
+#   PROMETHEUS_MULTIPROC_DIR  - with several worker processes, a directory
+#                               they share: each one keeps a snapshot of its
+#                               metrics there and a scrape merges them all
+#   METRICS_SNAPSHOT_INTERVAL_MS - how often a worker refreshes its snapshot
+# The directory should be emptied when the server starts, as with
+# prometheus_client's own multiprocess mode.
+
+MODE = os.getenv("METRICS_MODE", "otlp")
+EXPORT_INTERVAL_MS = os.getenv("METRICS_EXPORT_INTERVAL_MS")
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+SNAPSHOT_INTERVAL_MS = int(os.getenv("METRICS_SNAPSHOT_INTERVAL_MS", 1000))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Kinds whose values only make sense while their process is alive: the
+# snapshots of dead workers keep counting their counters and histograms,
+# but not these
+LIVE_KINDS = ("gauge", "updown")
+
+_reader = None
+_owner_pid = None
+_collect_lock = threading.Lock()
+
+
+def setup(
+    resource, endpoint: str, views=(), export_interval_millis: float = None
+) -> MeterProvider:
+    global _reader, _owner_pid
+    _owner_pid = os.getpid()
+    if EXPORT_INTERVAL_MS:
+        export_interval_millis = float(EXPORT_INTERVAL_MS)
+    if MODE == "prometheus":
+        _reader = InMemoryMetricReader()
+    else:
+        _reader = PeriodicExportingMetricReader(
+            OTLPMetricExporter(endpoint=endpoint),
+            export_interval_millis=export_interval_millis,
+        )
+    provider = MeterProvider(
+        resource=resource, metric_readers=[_reader], views=list(views)
+    )
+    metrics.set_meter_provider(provider)
+    if MODE == "prometheus" and MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        threading.Thread(target=_snapshot_loop, daemon=True).start()
+        atexit.register(_write_final_snapshot)
+    return provider
+
+
+def _labels(attributes) -> dict:
+    return {
+        re.sub(r"[^a-zA-Z0-9_]", "_", key): str(value)
+        for key, value in (attributes or {}).items()
+    }
+
+
+# Current values of every instrument of this process, as plain data that
+# can be written to disk and merged with the other workers'
+def snapshot() -> list:
+    with _collect_lock:
+        data = _reader.get_metrics_data()
+    result = []
+    for resource_metrics in data.resource_metrics if data else ():
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                points = []
+                if isinstance(metric.data, Histogram):
+                    kind = "histogram"
+                    for point in metric.data.data_points:
+                        points.append(
+                            {
+                                "labels": _labels(point.attributes),
+                                "bounds": list(point.explicit_bounds),
+                                "counts": list(point.bucket_counts),
+                                "sum": point.sum,
+                                "count": point.count,
+                            }
+                        )
+                elif isinstance(metric.data, (Sum, Gauge)):
+                    if isinstance(metric.data, Gauge):
+                        kind = "gauge"
+                    else:
+                        kind = "counter" if metric.data.is_monotonic else "updown"
+                    for point in metric.data.data_points:
+                        points.append(
+                            {"labels": _labels(point.attributes), "value": point.value}
+                        )
+                else:
+                    continue
+                result.append(
+                    {
+                        "name": metric.name,
+                        "description": metric.description,
+                        "kind": kind,
+                        "points": points,
+                    }
+                )
+    return result
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(MULTIPROC_DIR, f"{pid}.json")
+
+
+def write_snapshot(metrics_snapshot: list = None):
+    if metrics_snapshot is None:
+        metrics_snapshot = snapshot()
+    path = _snapshot_path(os.getpid())
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(metrics_snapshot, file)
+    os.replace(temporary, path)
+
+
+# Processes forked from a worker (such as executor pools) inherit its
+# metrics and must not overwrite its snapshot with them
+def _write_final_snapshot():
+    if os.getpid() == _owner_pid:
+        write_snapshot()
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL_MS / 1000)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Snapshots of the other workers as (pid, alive, snapshot)
+def _worker_snapshots():
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.json")):
+        try:
+            pid = int(os.path.basename(path)[: -len(".json")])
+            with open(path) as file:
+                worker_snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if pid != os.getpid():
+            yield pid, _alive(pid), worker_snapshot
+
+
+# Sums counters, up-down counters and histogram buckets over the workers.
+# Gauges cannot be summed, each worker's value is kept under a pid label.
+def merge(snapshots, label_pid: bool = False) -> dict:
+    merged = {}
+    for pid, alive, metrics_snapshot in snapshots:
+        for metric in metrics_snapshot:
+            if metric["kind"] in LIVE_KINDS and not alive:
+                continue
+            entry = merged.setdefault(
+                metric["name"],
+                {
+                    "description": metric["description"],
+                    "kind": metric["kind"],
+                    "points": {},
+                },
+            )
+            for point in metric["points"]:
+                labels = point["labels"]
+                if label_pid and metric["kind"] == "gauge":
+                    labels = {**labels, "pid": str(pid)}
+                key = tuple(sorted(labels.items()))
+                previous = entry["points"].get(key)
+                if previous is None:
+                    entry["points"][key] = dict(point, labels=labels)
+                elif metric["kind"] == "histogram":
+                    if previous["bounds"] != point["bounds"]:
+                        continue
+                    previous["counts"] = [
+                        a + b for a, b in zip(previous["counts"], point["counts"])
+                    ]
+                    previous["sum"] += point["sum"]
+                    previous["count"] += point["count"]
+                else:
+                    previous["value"] += point["value"]
+    return merged
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _families(merged: dict):
+    for name, metric in merged.items():
+        name = _metric_name(name)
+        points = list(metric["points"].values())
+        label_names = sorted({key for point in points for key in point["labels"]})
+        if metric["kind"] == "histogram":
+            family = HistogramMetricFamily(
+                name, metric["description"], labels=label_names
+            )
+        elif metric["kind"] == "counter":
+            family = CounterMetricFamily(name, metric["description"], labels=label_names)
+        else:
+            family = GaugeMetricFamily(name, metric["description"], labels=label_names)
+        for point in points:
+            values = [point["labels"].get(key, "") for key in label_names]
+            if metric["kind"] == "histogram":
+                buckets, total = [], 0
+                for bound, count in zip(point["bounds"] + ["+Inf"], point["counts"]):
+                    total += count
+                    buckets.append((str(bound), total))
+                family.add_metric(values, buckets, sum_value=point["sum"])
+            else:
+                family.add_metric(values, point["value"])
+        yield family
+
+
+class _Collector:
+    def __init__(self, merged: dict):
+        self.merged = merged
+
+    def collect(self):
+        return _families(self.merged)
+
+
+# Prometheus text exposition of this process' metrics, merged at scrape time
+# with the latest snapshots of the other workers when there are several
+def render() -> bytes:
+    own = snapshot()
+    snapshots = [(os.getpid(), True, own)]
+    if MULTIPROC_DIR:
+        write_snapshot(own)
+        snapshots.extend(_worker_snapshots())
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(_Collector(merge(snapshots, label_pid=bool(MULTIPROC_DIR))))
+    return generate_latest(registry)
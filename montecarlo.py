@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cancellation
+
+# Number of points drawn per numpy batch; the time budget is only checked
+# between batches so the clock is not read on every sample
+BATCH_SIZE = 1 << 18
+
+# Upper bound for the workers=K option, one process per core by default
+POOL_SIZE = int(os.getenv("PI_POOL_SIZE", os.cpu_count() or 1))
+
+# The python loop checks for cancellation once every CHECK_MASK + 1 samples
+CHECK_MASK = 0xFFFF
+
+_pool = None
+
+
+# Pure python estimator, one sample per iteration
+def pi_python(seconds: float = None, samples: int = None, rng=None):
+    if rng is None:
+        rng = random
+    inside = 0
+    total = 0
+    if samples is not None:
+        for i in range(samples):
+            if i & CHECK_MASK == 0:
+                cancellation.check()
+            x = rng.random()
+            y = rng.random()
+            if x**2 + y**2 <= 1:
+                inside += 1
+        return inside, samples
+
+    start_time = time.time()
+    while True:
+        x = rng.random()
+        y = rng.random()
+        if x**2 + y**2 <= 1:
+            inside += 1
+        total += 1
+        if time.time() - start_time >= seconds:
+            break
+        if total & CHECK_MASK == 0:
+            cancellation.check()
+    return inside, total
+
+
+def _count_inside(rng, n: int) -> int:
+    points = rng.random((2, n))
+    return int(np.count_nonzero(points[0] * points[0] + points[1] * points[1] <= 1.0))
+
+
+# Vectorized estimator, samples are drawn in fixed size batches
+def pi_numpy(
+    seconds: float = None, samples: int = None, batch_size: int = BATCH_SIZE, rng=None
+):
+    if rng is None:
+        rng = np.random.default_rng()
+    inside = 0
+    total = 0
+    if samples is not None:
+        while total < samples:
+            cancellation.check()
+            n = min(batch_size, samples - total)
+            inside += _count_inside(rng, n)
+            total += n
+        return inside, total
+
+    deadline = time.perf_counter() + seconds
+    while True:
+        cancellation.check()
+        inside += _count_inside(rng, batch_size)
+        total += batch_size
+        if time.perf_counter() >= deadline:
+            break
+    return inside, total
+
+
+def estimate(engine: str, seconds: float = None, samples: int = None, rng=None):
+    if engine == "numpy":
+        return pi_numpy(seconds, samples, rng=rng)
+    return pi_python(seconds, samples, rng=rng)
+
+
+# Runs inside a pool process. The deadline is a wall clock timestamp shared
+# with the parent so process start up is charged to the same budget.
+def _worker(engine: str, seed_seq, deadline: float = None, samples: int = None):
+    start_ns = time.time_ns()
+    if engine == "numpy":
+        rng = np.random.default_rng(seed_seq)
+    else:
+        rng = random.Random(int(seed_seq.generate_state(1, np.uint64)[0]))
+    seconds = None
+    if samples is None:
+        seconds = max(deadline - time.time(), 0.0)
+    inside, total = estimate(engine, seconds, samples, rng)
+    return {
+        "pid": os.getpid(),
+        "inside": inside,
+        "total": total,
+        "start_ns": start_ns,
+        "end_ns": time.time_ns(),
+    }
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn keeps the exporter threads of the api process out of the workers
+        context = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(
+            max_workers=POOL_SIZE,
+            mp_context=context,
+            **cancellation.pool_options(context),
+        )
+    return _pool
+
+
+# Splits one estimation across `workers` processes, each with its own child
+# of a SeedSequence so the random streams are statistically independent.
+# Returns one future per worker.
+def submit_parallel(
+    engine: str,
+    workers: int,
+    seconds: float = None,
+    samples: int = None,
+    seed: int = None,
+):
+    workers = min(workers, POOL_SIZE)
+    seed_seqs = np.random.SeedSequence(seed).spawn(workers)
+    pool = get_pool()
+    if samples is not None:
+        share, rest = divmod(samples, workers)
+        counts = [share + (1 if i < rest else 0) for i in range(workers)]
+        return [
+            cancellation.submit(pool, _worker, engine, seed_seqs[i], None, counts[i])
+            for i in range(workers)
+            if counts[i] > 0
+        ]
+
+    deadline = time.time() + seconds
+    return [
+        cancellation.submit(pool, _worker, engine, seed_seq, deadline)
+        for seed_seq in seed_seqs
+    ]
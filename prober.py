@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import socket
+import struct
+import time
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Defaults for /latency, overridable per request
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", 10))
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", 0.0))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", 2))
+
+logger = logging.getLogger(__name__)
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(identifier: int, sequence: int, size: int) -> bytes:
+    payload = bytes(size)
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    header = struct.pack(
+        "!BBHHH",
+        ICMP_ECHO_REQUEST,
+        0,
+        checksum(header + payload),
+        identifier,
+        sequence,
+    )
+    return header + payload
+
+
+# Sends echo requests through a single ICMP socket shared by every probe of
+# the process. Replies are read by an event loop reader and matched to the
+# waiting probe by ICMP identifier and sequence number.
+class IcmpProber:
+    def __init__(self):
+        self.loop = None
+        self.sock = None
+        self.raw = True
+        self.identifier = os.getpid() & 0xFFFF
+        self.sequence = 0
+        self.pending = {}
+
+    def open(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.sock = socket.socket(
+                socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP
+            )
+        except PermissionError:
+            # unprivileged ICMP, the kernel rewrites the identifier to the
+            # socket's port and only delivers replies for this socket
+            self.sock = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP
+            )
+            self.raw = False
+        try:
+            self.sock.setblocking(False)
+            if not self.raw:
+                self.sock.bind(("", 0))
+                self.identifier = self.sock.getsockname()[1]
+            self.loop.add_reader(self.sock.fileno(), self._on_readable)
+        except BaseException:
+            # left closed, the next probe tries again
+            self.sock.close()
+            self.sock = None
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def _ensure_open(self):
+        if self.sock is None:
+            self.open()
+        elif self.loop is not asyncio.get_running_loop():
+            self.close()
+            self.open()
+
+    def _on_readable(self):
+        received = time.perf_counter()
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self.raw:
+                # skip the ip header
+                packet = packet[(packet[0] & 0x0F) * 4 :]
+            if len(packet) < 8:
+                continue
+            kind, _, _, identifier, sequence = struct.unpack("!BBHHH", packet[:8])
+            if kind != ICMP_ECHO_REPLY:
+                continue
+            if self.raw and identifier != self.identifier:
+                continue
+            future = self.pending.get((address[0], sequence))
+            if future is not None and not future.done():
+                future.set_result(received)
+
+    def _next_sequence(self) -> int:
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return self.sequence
+
+    # Round trip time in seconds, None if no reply arrived before the timeout
+    async def probe(self, address: str, size: int, timeout: float = PROBE_TIMEOUT):
+        self._ensure_open()
+        sequence = self._next_sequence()
+        key = (address, sequence)
+        future = self.loop.create_future()
+        self.pending[key] = future
+        try:
+            sent = time.perf_counter()
+            self.sock.sendto(
+                echo_request(self.identifier, sequence, size), (address, 0)
+            )
+            received = await asyncio.wait_for(future, timeout)
+            return received - sent
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self.pending.pop(key, None)
+
+
+_prober = IcmpProber()
+
+
+async def resolve(host: str) -> str:
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, None, family=socket.AF_INET)
+    return infos[0][4][0]
+
+
+async def ping(address: str, size: int, timeout: float = PROBE_TIMEOUT):
+    return await _prober.probe(address, size, timeout)
+
+
+# Runs `count` probes against host with at most `concurrency` in flight and
+# at least `interval` seconds between two sends. `probe` is called as
+# probe(address, size, timeout) and can wrap ping to trace every attempt.
+# Returns the rtt of every attempt in order, None for the lost ones.
+async def probe_many(
+    host: str,
+    count: int,
+    size: int,
+    concurrency: int = PROBE_CONCURRENCY,
+    interval: float = PROBE_INTERVAL,
+    timeout: float = PROBE_TIMEOUT,
+    probe=ping,
+):
+    address = await resolve(host)
+    slots = asyncio.Semaphore(concurrency)
+    results = [None] * count
+
+    async def attempt(index: int):
+        try:
+            results[index] = await probe(address, size, timeout)
+        finally:
+            slots.release()
+
+    tasks = []
+    for index in range(count):
+        if index and interval:
+            await asyncio.sleep(interval)
+        await slots.acquire()
+        tasks.append(asyncio.ensure_future(attempt(index)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+# Probes a fixed set of targets in the background and caches the last rtt of
+# each, so metric callbacks only read memory instead of waiting on the network
+class RttMonitor:
+    def __init__(self, targets, interval: float, size: int, timeout: float):
+        self.targets = targets
+        self.interval = interval
+        self.size = size
+        self.timeout = timeout
+        # host -> (rtt in seconds, unix timestamp of the reply)
+        self.latest = {}
+        self.task = None
+        # last error of a round, logged once until a round succeeds again
+        self.error = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _probe(self, host: str):
+        try:
+            address = await resolve(host)
+        except OSError:
+            return
+        rtt = await ping(address, self.size, self.timeout)
+        if rtt is not None:
+            self.latest[host] = (rtt, time.time())
+
+    # A round that fails, e.g. when the ICMP socket cannot be opened, is
+    # logged and the next one tries again, so the gauges recover with it
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                await asyncio.gather(*[self._probe(host) for host in self.targets])
+            except Exception as error:
+                if repr(error) != self.error:
+                    logger.warning(f"RTT monitor round failed: {error!r}")
+                    self.error = repr(error)
+            else:
+                if self.error is not None:
+                    logger.info("RTT monitor recovered")
+                    self.error = None
+            await asyncio.sleep(max(self.interval - (loop.time() - started), 0))
+
+
+def monitor_from_env() -> RttMonitor:
+    targets = os.getenv("RTT_MONITOR_TARGETS", "8.8.8.8")
+    return RttMonitor(
+        [target.strip() for target in targets.split(",") if target.strip()],
+        interval=float(os.getenv("RTT_MONITOR_INTERVAL", 1)),
+        size=int(os.getenv("RTT_MONITOR_SIZE", 65000)),
+        timeout=PROBE_TIMEOUT,
+    )
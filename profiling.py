@@ -0,0 +1,248 @@
+import cProfile
+import contextlib
+import glob
+import inspect
+import os
+import pstats
+import re
+import tempfile
+import threading
+import tracemalloc
+
+from fastapi import HTTPException, Query
+from fastapi.responses import Response
+
+# On-demand profiling of single requests, from the environment:
+#   PROFILING_ENABLED  - "1" adds a profile=cpu|mem query parameter to every
+#                        workload endpoint and serves /profiles/{trace_id}
+#   PROFILE_DIR        - where the profiles are kept, shared by the workers
+#   PROFILE_RETENTION  - most profiles kept, the oldest are deleted first
+#   PROFILE_MAX_BYTES  - most bytes kept, likewise
+#   PROFILE_TOP        - hot frames added to the span as events
+# A cpu profile runs the handler under cProfile and is stored as a pstats
+# file (python -m pstats, snakeviz); a mem profile runs it under tracemalloc
+# and stores the final snapshot (tracemalloc.Snapshot.load). The profile
+# covers the handler only: a streamed body is produced after it returns, and
+# kernels sent to the process pool run outside it. cProfile follows the
+# thread it was started on (every thread from Python 3.12), so a cpu
+# profile of an async handler also sees whatever else the event loop ran.
+
+ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles")
+)
+PROFILE_RETENTION = int(os.getenv("PROFILE_RETENTION", 100))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", 64 * 1024 * 1024))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 10))
+
+KINDS = ("cpu", "mem")
+# Response header carrying the trace id the profile is stored under
+HEADER = "X-Profile-Id"
+
+# cProfile and tracemalloc are process wide, one profile runs at a time
+_lock = threading.Lock()
+
+_TRACE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class CpuProfile:
+    extension = "pstats"
+
+    def start(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    # Functions with the most time spent in their own code
+    def top(self, count: int) -> list:
+        stats = pstats.Stats(self.profiler)
+        stats.sort_stats("tottime")
+        frames = []
+        for function in stats.fcn_list[:count]:
+            _, calls, self_seconds, cumulative_seconds, _ = stats.stats[function]
+            filename, line, name = function
+            frames.append(
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "self_seconds": self_seconds,
+                    "cumulative_seconds": cumulative_seconds,
+                }
+            )
+        return frames
+
+    def summary(self) -> dict:
+        stats = pstats.Stats(self.profiler)
+        return {"calls": stats.total_calls, "seconds": stats.total_tt}
+
+    def dump(self, path: str):
+        self.profiler.dump_stats(path)
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+    )
+
+
+class MemoryProfile:
+    extension = "tracemalloc"
+
+    def start(self):
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+        self.before = _snapshot()
+        tracemalloc.reset_peak()
+        self.traced, _ = tracemalloc.get_traced_memory()
+
+    def stop(self):
+        traced, peak = tracemalloc.get_traced_memory()
+        self.held = traced - self.traced
+        self.peak = peak - self.traced
+        self.after = _snapshot()
+        if self.started:
+            tracemalloc.stop()
+
+    # Lines whose allocations grew the most while the handler ran
+    def top(self, count: int) -> list:
+        return [
+            {
+                "function": str(stat.traceback[0]),
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size,
+            }
+            for stat in self.after.compare_to(self.before, "lineno")[:count]
+        ]
+
+    # Bytes still held when the handler returned, and the most it had
+    # allocated at once, transient allocations included
+    def summary(self) -> dict:
+        return {"held_bytes": self.held, "peak_bytes": self.peak}
+
+    def dump(self, path: str):
+        self.after.dump(path)
+
+
+PROFILERS = {"cpu": CpuProfile, "mem": MemoryProfile}
+
+
+# Deletes the oldest profiles beyond PROFILE_RETENTION or PROFILE_MAX_BYTES
+def _trim():
+    profiles = []
+    for path in glob.glob(os.path.join(PROFILE_DIR, "*")):
+        try:
+            profiles.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except OSError:
+            continue
+    kept = 0
+    kept_bytes = 0
+    for _, size, path in sorted(profiles, reverse=True):
+        kept += 1
+        kept_bytes += size
+        if kept > PROFILE_RETENTION or kept_bytes > PROFILE_MAX_BYTES:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def store(trace_id: str, profiler) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{trace_id}.{profiler.extension}")
+    profiler.dump(path)
+    _trim()
+    return path
+
+
+# Path of the profile stored for a trace, None when there is none
+def find(trace_id: str) -> str:
+    if not _TRACE_ID.fullmatch(trace_id):
+        return None
+    paths = glob.glob(os.path.join(PROFILE_DIR, f"{trace_id}.*"))
+    return paths[0] if paths else None
+
+
+# Profiles the body in a span of its own, made current so the workload's
+# spans nest under it, and adds the hot frames to it as events. Yields the
+# trace id the profile is stored under.
+@contextlib.contextmanager
+def profiled(kind: str, tracer, name: str):
+    if not _lock.acquire(blocking=False):
+        raise HTTPException(
+            status_code=409, detail="Another request is being profiled, retry later"
+        )
+    try:
+        with tracer.start_as_current_span(f"profile {name}") as span:
+            trace_id = format(span.get_span_context().trace_id, "032x")
+            span.set_attribute("profile.kind", kind)
+            profiler = PROFILERS[kind]()
+            profiler.start()
+            try:
+                yield trace_id
+            finally:
+                profiler.stop()
+                for key, value in profiler.summary().items():
+                    span.set_attribute(f"profile.{key}", value)
+                frames = profiler.top(PROFILE_TOP)
+                for frame in frames:
+                    span.add_event("profile.frame", frame)
+                span.set_attribute("profile.top", [f["function"] for f in frames])
+                path = store(trace_id, profiler)
+                span.set_attribute("profile.file", os.path.basename(path))
+    finally:
+        _lock.release()
+
+
+def _tag(result, response: Response, trace_id: str):
+    # a Response returned by the handler is sent as is, without the headers
+    # set on the injected one
+    target = result if isinstance(result, Response) else response
+    target.headers[HEADER] = trace_id
+    return result
+
+
+# The endpoint `func` with a profile query parameter added. Without it the
+# call goes straight through; with it the call is profiled and the response
+# carries the trace id to download the profile with.
+def wrap(func, tracer):
+    parameters = list(inspect.signature(func).parameters.values()) + [
+        inspect.Parameter(
+            "profile",
+            inspect.Parameter.KEYWORD_ONLY,
+            default=Query(None, pattern=f"^({'|'.join(KINDS)})$"),
+            annotation=str,
+        ),
+        inspect.Parameter(
+            "response", inspect.Parameter.KEYWORD_ONLY, annotation=Response
+        ),
+    ]
+
+    if inspect.iscoroutinefunction(func):
+
+        async def run(*args, profile: str = None, response: Response = None, **kwargs):
+            if profile is None:
+                return await func(*args, **kwargs)
+            with profiled(profile, tracer, func.__name__) as trace_id:
+                result = await func(*args, **kwargs)
+            return _tag(result, response, trace_id)
+
+    else:
+
+        def run(*args, profile: str = None, response: Response = None, **kwargs):
+            if profile is None:
+                return func(*args, **kwargs)
+            with profiled(profile, tracer, func.__name__) as trace_id:
+                result = func(*args, **kwargs)
+            return _tag(result, response, trace_id)
+
+    run.__name__ = func.__name__
+    run.__doc__ = func.__doc__
+    run.__signature__ = inspect.Signature(parameters)
+    return run
@@ -1,9 +1,16 @@
+import asyncio
+import json
 import logging
 import os
+import random
+import time
 from concurrent.futures import ThreadPoolExecutor
 
+import httpx
 import requests
 
+import latency_stats
+
 # Configure logging for k8s
 logging.basicConfig(
     level=logging.INFO,
@@ -11,142 +18,419 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, the async engine logs its own lines
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 BASE_URL = os.getenv("API_ENDPOINT", "http://localhost:8000")
 
 
-def test_sort(max_size: int, time_out: float, increment: int):
-    url = f"{BASE_URL}/sort"
-    params = {"max_size": max_size, "time_out": time_out, "increment": increment}
-
-    try:
-        response = requests.get(url, params=params)
-        logger.info(
-            f"Sort test: Status: {response.status_code}, Response: {response.json()}"
+def read_config(file_path="config.txt"):
+    config = {}
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(
+            f"Arquivo de configuração '{file_path}' não encontrado."
         )
-    except Exception as e:
-        logger.error(f"Sort test: Error: {e}")
 
+    with open(file_path, "r") as file:
+        for line in file:
+            if "=" in line:
+                key, value = line.strip().split("=", 1)
+                config[key.strip()] = value.strip()
+    return config
 
-def test_latency():
-    url = f"{BASE_URL}/latency"
 
-    try:
-        response = requests.get(url)
-        logger.info(
-            f"Latency test: Status: {response.status_code}, Response: {response.json()}"
+# Requests the load engines can send, as (name, path, params)
+def build_requests(config, functions):
+    trys = int(config.get("trys", 10))
+    host = config.get("host", "8.8.8.8")
+    max_size = int(config.get("max_size", 10000))
+    time_out = float(config.get("time_out", 0.5))
+    increment = int(config.get("increment", 500))
+    payload_size = int(config.get("payload_size", 32))
+    pi_seconds = float(config.get("pi_seconds", 1))
+    target = int(config.get("target", 100000000))
+    object_count = int(config.get("object_count", 1000000))
+
+    available = {
+        "latency": (
+            "/latency",
+            {"tentativas": trys, "host": host, "size": payload_size},
+        ),
+        "sort": (
+            "/sort",
+            {"max_size": max_size, "time_out": time_out, "increment": increment},
+        ),
+        "calculate_pi": ("/calculate-pi", {"seconds": pi_seconds}),
+        "sum_of_n_numbers": ("/sum-of-n-numbers", {"target": target}),
+        "object_creation_deletion": (
+            "/object-creation-deletion",
+            {"count": object_count},
+        ),
+    }
+    return [
+        (name, path, params)
+        for name, (path, params) in available.items()
+        if functions == "all" or name in functions
+    ]
+
+
+# Latency percentiles of the per stage reports
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+
+# Resolution (seconds) at which a varying rate is integrated into send times
+RATE_STEP = 0.001
+
+# Shape of the rate over a stage, `stages` entries are kind:duration:rates
+#   steady:60:20       - 20 requests/s for 60 s
+#   ramp_up:30:1:20    - from 1 to 20 requests/s, linearly, over 30 s
+#   spike:10:100       - a short burst at 100 requests/s
+#   step:60:20:60:4    - from 20 to 60 requests/s in 4 equal steps over 60 s
+STAGE_KINDS = {"steady": 1, "ramp_up": 2, "spike": 1, "step": 3}
+
+
+def stage_rate(kind: str, duration: float, args):
+    if kind in ("steady", "spike"):
+        return lambda offset: args[0]
+    if kind == "ramp_up":
+        low, high = args
+        return lambda offset: low + (high - low) * offset / duration
+    low, high, steps = args
+    steps = max(int(steps), 1)
+
+    def rate(offset):
+        step = min(int(offset * steps / duration), steps - 1)
+        return low + (high - low) * step / max(steps - 1, 1)
+
+    return rate
+
+
+def parse_stages(value: str):
+    stages = []
+    for index, spec in enumerate(part.strip() for part in value.split(",")):
+        if not spec:
+            continue
+        kind, *numbers = [field.strip() for field in spec.split(":")]
+        if kind not in STAGE_KINDS:
+            raise ValueError(
+                f"Unknown stage kind '{kind}', expected one of {', '.join(STAGE_KINDS)}"
+            )
+        if len(numbers) != STAGE_KINDS[kind] + 1:
+            raise ValueError(
+                f"Stage '{spec}' expects a duration and {STAGE_KINDS[kind]} rate value(s)"
+            )
+        duration, *args = [float(number) for number in numbers]
+        stages.append(
+            {
+                "name": f"{index + 1}-{kind}",
+                "kind": kind,
+                "duration": duration,
+                "spec": spec,
+                "rate": stage_rate(kind, duration, args),
+            }
         )
-    except Exception as e:
-        logger.error(f"Latency test: Error: {e}")
+    return stages
+
+
+# Stages of the run: the `stages` profile when set, else one steady stage at
+# `rate` for `duration` seconds, else a single burst of every request at once
+def build_stages(config):
+    if config.get("stages"):
+        return parse_stages(config["stages"])
+    rate = float(config.get("rate", 0))
+    if rate > 0:
+        duration = float(config.get("duration", 60))
+        return [
+            {
+                "name": "1-steady",
+                "kind": "steady",
+                "duration": duration,
+                "spec": f"steady:{duration:g}:{rate:g}",
+                "rate": lambda offset: rate,
+            }
+        ]
+    return [{"name": "1-burst", "kind": "burst", "duration": 0.0, "spec": "burst"}]
+
 
+# Send offsets (seconds from the start of the stage) of an open-loop run.
+# `rate` maps an offset to requests per second; it is integrated in small
+# steps and a request is due every time the expected number of arrivals
+# crosses the next threshold: 1 apart for evenly spaced sends, exponentially
+# distributed for a (non homogeneous) Poisson process.
+def arrival_times(rate, duration: float, arrivals: str = "poisson"):
+    def gap():
+        return 1.0 if arrivals == "constant" else random.expovariate(1.0)
 
-def test_calculate_pi(seconds: float):
-    url = f"{BASE_URL}/calculate-pi"
-    params = {"seconds": seconds}
+    times = []
+    offset = 0.0
+    expected = 0.0
+    threshold = 0.0 if arrivals == "constant" else gap()
+    while offset < duration:
+        step = min(RATE_STEP, duration - offset)
+        current = max(rate(offset), 0.0)
+        while current > 0 and expected + current * step >= threshold:
+            times.append(offset + (threshold - expected) / current)
+            threshold += gap()
+        expected += current * step
+        offset += step
+    return times
 
+
+# Sends one request once its scheduled time comes. Latency is measured from
+# the scheduled time, not from the actual send, so a slow server cannot hide
+# its queueing delay behind a client that fell behind (coordinated omission).
+async def send_scheduled(client, start, offset, name, path, params, results):
+    loop = asyncio.get_running_loop()
+    scheduled = start + offset
+    delay = scheduled - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    sent = loop.time()
+    status = None
+    error = None
     try:
-        response = requests.get(url, params=params)
-        logger.info(
-            f"Calculate Pi test: Status: {response.status_code}, Response: {response.json()}"
-        )
+        response = await client.get(path, params=params)
+        status = response.status_code
+        if status >= 400:
+            error = response.text
     except Exception as e:
-        logger.error(f"Calculate Pi test: Error: {e}")
+        error = repr(e)
+    finished = loop.time()
+    results.append(
+        {
+            "name": name,
+            "scheduled": scheduled - start,
+            "send_delay": sent - scheduled,
+            "latency": finished - scheduled,
+            "service_time": finished - sent,
+            "status": status,
+            "error": error,
+        }
+    )
+    if error is None:
+        logger.info(f"{name}: Status: {status}, Latency: {finished - scheduled:.4f}s")
+    else:
+        logger.error(f"{name}: Status: {status}, Error: {error}")
 
 
-def test_sum_of_n_numbers(target: int):
-    url = f"{BASE_URL}/sum-of-n-numbers"
-    params = {"target": target}
+def summarize_results(results, duration: float) -> dict:
+    histogram = latency_stats.LogHistogram()
+    errors = 0
+    for result in results:
+        if result["error"] is None:
+            histogram.record(result["latency"])
+        else:
+            errors += 1
+    summary = {
+        "count": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "throughput": (len(results) - errors) / duration if duration > 0 else 0.0,
+    }
+    latency = {"count": histogram.count}
+    if histogram.count:
+        latency["min"] = histogram.min
+        for percentile in REPORT_PERCENTILES:
+            latency[f"p{percentile:g}"] = histogram.percentile(percentile)
+        latency["max"] = histogram.max
+        latency["mean"] = histogram.total / histogram.count
+    summary["latency"] = latency
+    return summary
 
-    try:
-        response = requests.get(url, params=params)
+
+# Per endpoint and overall figures of one stage. Successful responses only
+# count towards the latency percentiles and the throughput, which is taken
+# over the stage duration (or the time the burst took to complete).
+def stage_report(stage, results, elapsed: float) -> dict:
+    duration = stage["duration"] or elapsed
+    return {
+        "stage": stage["name"],
+        "kind": stage["kind"],
+        "spec": stage["spec"],
+        "duration": duration,
+        "elapsed": elapsed,
+        "endpoints": {
+            name: summarize_results(
+                [result for result in results if result["name"] == name], duration
+            )
+            for name in sorted({result["name"] for result in results})
+        },
+        "total": summarize_results(results, duration),
+    }
+
+
+def log_report(report):
+    def line(name, summary):
+        latency = summary["latency"]
+        percentiles = ", ".join(
+            f"p{percentile:g} {latency[f'p{percentile:g}']:.4f}s"
+            for percentile in REPORT_PERCENTILES
+            if f"p{percentile:g}" in latency
+        )
         logger.info(
-            f"Sum of N Numbers test: Status: {response.status_code}, Response: {response.json()}"
+            f"[{report['stage']}] {name}: {summary['count']} requests, "
+            f"{summary['errors']} errors ({100 * summary['error_rate']:.1f}%), "
+            f"{summary['throughput']:.2f} req/s"
+            + (f", latency {percentiles}" if percentiles else "")
         )
-    except Exception as e:
-        logger.error(f"Sum of N Numbers test: Error: {e}")
 
+    for name, summary in report["endpoints"].items():
+        line(name, summary)
+    line("total", report["total"])
 
-def test_object_creation_deletion(count: int):
-    url = f"{BASE_URL}/object-creation-deletion"
-    params = {"count": count}
 
-    try:
-        response = requests.get(url, params=params)
-        logger.info(
-            f"Object Creation/Deletion test: Status: {response.status_code}, Response: {response.json()}"
+def write_reports(file_path, config, reports):
+    with open(file_path, "w") as file:
+        json.dump(
+            {"base_url": BASE_URL, "config": config, "stages": reports},
+            file,
+            indent=2,
         )
-    except Exception as e:
-        logger.error(f"Object Creation/Deletion test: Error: {e}")
 
 
-def read_config(file_path="config.txt"):
-    config = {}
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(
-            f"Arquivo de configuração '{file_path}' não encontrado."
+# Open-loop load: requests go out on their own schedule whatever the server's
+# response times, spread round robin over the selected endpoints, through a
+# single keep-alive connection pool. Stages follow each other on the clock,
+# a stage is reported once all of its requests have completed, even if the
+# next stage already started sending. Without a rate every request is sent
+# at once, like the thread engine does.
+async def run_async_load(config, functions, requests_count):
+    arrivals = config.get("arrivals", "poisson")
+    max_connections = int(config.get("max_connections", 100))
+    request_timeout = float(config.get("request_timeout", 60))
+    report_file = config.get("report_file", "load_report.json")
+
+    workloads = build_requests(config, functions)
+    stages = build_stages(config)
+    schedule = []
+    stage_start = 0.0
+    for stage in stages:
+        if stage["kind"] == "burst":
+            offsets = [0.0] * (requests_count * len(workloads))
+        else:
+            offsets = arrival_times(stage["rate"], stage["duration"], arrivals)
+        schedule.append(
+            (stage, stage_start, [stage_start + offset for offset in offsets])
         )
+        stage_start += stage["duration"]
+        logger.info(f"Stage {stage['name']} ({stage['spec']}): {len(offsets)} requests")
 
-    with open(file_path, "r") as file:
-        for line in file:
-            if "=" in line:
-                key, value = line.strip().split("=", 1)
-                config[key.strip()] = value.strip()
-    return config
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+    reports = [None] * len(stages)
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, limits=limits, timeout=request_timeout
+    ) as client:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
 
+        # Starts each request's task when it is due, only the requests in
+        # flight are held however long the stage
+        async def run_stage(position, stage, stage_start, offsets, index):
+            results = []
+            pending = set()
+            for i, offset in enumerate(offsets):
+                delay = start + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                task = asyncio.create_task(
+                    send_scheduled(
+                        client,
+                        start,
+                        offset,
+                        *workloads[(index + i) % len(workloads)],
+                        results,
+                    )
+                )
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+            report = stage_report(stage, results, loop.time() - start - stage_start)
+            log_report(report)
+            reports[position] = report
+            write_reports(
+                report_file, config, [report for report in reports if report]
+            )
 
-def run_tests_in_parallel(test_functions):
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(func) for func in test_functions]
-        for future in futures:
-            try:
-                future.result()
-            except Exception as e:
-                logger.error(f"Error in parallel execution: {e}")
+        tasks = []
+        for position, (stage, stage_start, offsets) in enumerate(schedule):
+            tasks.append(run_stage(position, stage, stage_start, offsets, sent))
+            sent += len(offsets)
+        await asyncio.gather(*tasks)
+    logger.info(f"Load report written to {report_file}")
+    return reports
 
 
-if __name__ == "__main__":
+# Blocking counterpart of send_scheduled for the thread engine, every
+# request is scheduled at `start`
+def send_blocking(start, name, path, params, results):
+    sent = time.perf_counter()
+    status = None
+    error = None
     try:
-        config = read_config("config.txt")
-        trys = int(config.get("trys", 10))
-        host = config.get("host", "8.8.8.8")
-        requests_count = int(config.get("requests", 5))
-        max_size = int(config.get("max_size", 10000))
-        time_out = float(config.get("time_out", 0.5))
-        increment = int(config.get("increment", 500))
-        payload_size = int(config.get("payload_size", 32))
-        pi_seconds = float(config.get("pi_seconds", 1))
-        target = int(config.get("target", 100000000))
-        object_count = int(config.get("object_count", 1000000))
-        functions = config.get("functions", "all")
+        response = requests.get(f"{BASE_URL}{path}", params=params)
+        status = response.status_code
+        if status >= 400:
+            error = response.text
+    except Exception as e:
+        error = repr(e)
+    finished = time.perf_counter()
+    results.append(
+        {
+            "name": name,
+            "scheduled": 0.0,
+            "send_delay": sent - start,
+            "latency": finished - start,
+            "service_time": finished - sent,
+            "status": status,
+            "error": error,
+        }
+    )
+    if error is None:
+        logger.info(f"{name}: Status: {status}, Latency: {finished - start:.4f}s")
+    else:
+        logger.error(f"{name}: Status: {status}, Error: {error}")
+
 
-        test_functions = []
+# Closed burst: `requests` rounds of the selected endpoints sent at once on a
+# pool of threads, reported as a single stage like the async engine's burst.
+# Rates and stages need the async engine's scheduler.
+def run_thread_load(config, functions, requests_count):
+    if config.get("stages") or float(config.get("rate", 0)) > 0:
+        raise ValueError(
+            "rate and stages need engine=async, the thread engine only sends bursts"
+        )
+    report_file = config.get("report_file", "load_report.json")
+    workloads = build_requests(config, functions)
+    stage = build_stages({})[0]
 
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor() as executor:
         for _ in range(requests_count):
+            for workload in workloads:
+                executor.submit(send_blocking, start, *workload, results)
+    report = stage_report(stage, results, time.perf_counter() - start)
+    log_report(report)
+    write_reports(report_file, config, [report])
+    logger.info(f"Load report written to {report_file}")
+    return [report]
 
-            if functions == "all":
-                test_functions.append(lambda: test_latency())
-                test_functions.append(lambda: test_sort(max_size, time_out, increment))
-                test_functions.append(lambda: test_calculate_pi(pi_seconds))
-                test_functions.append(lambda: test_sum_of_n_numbers(target))
-                test_functions.append(
-                    lambda: test_object_creation_deletion(object_count)
-                )
 
-            if "latency" in functions:
-                test_functions.append(lambda: test_latency())
-            if "sort" in functions:
-                test_functions.append(lambda: test_sort(max_size, time_out, increment))
-            if "calculate_pi" in functions:
-                test_functions.append(lambda: test_calculate_pi(pi_seconds))
-            if "sum_of_n_numbers" in functions:
-                test_functions.append(lambda: test_sum_of_n_numbers(target))
-            if "object_creation_deletion" in functions:
-                test_functions.append(
-                    lambda: test_object_creation_deletion(object_count)
-                )
+if __name__ == "__main__":
+    try:
+        config = read_config("config.txt")
+        requests_count = int(config.get("requests", 5))
+        functions = config.get("functions", "all")
+        engine = config.get("engine", "threads")
 
-        logger.info("Running tests in parallel...")
-        run_tests_in_parallel(test_functions)
+        if engine == "async":
+            logger.info("Running open-loop async load...")
+            asyncio.run(run_async_load(config, functions, requests_count))
+        else:
+            logger.info("Running tests in parallel...")
+            run_thread_load(config, functions, requests_count)
 
     except Exception as e:
         logger.error(f"Erro ao executar o script: {e}")
@@ -0,0 +1,87 @@
+# Strategies to find the largest list size a sort handles within time_out.
+#
+# Each strategy is a generator that yields the next size to measure and is
+# sent back the time it took. It returns (size, time) where size is the first
+# multiple of increment whose run exceeded time_out (or the next step past
+# max_size if none did) and time is the duration of that run. Keeping the
+# strategies free of the measuring code lets the workloads yield each
+# measurement as it is taken (see Sweep).
+
+STRATEGIES = ("linear", "exponential")
+
+
+# Walks every multiple of increment up to max_size
+def linear(max_size: int, increment: int, time_out: float):
+    current_size = increment
+    elapsed = None
+    while current_size <= max_size:
+        elapsed = yield current_size
+        if elapsed > time_out:
+            break
+        current_size += increment
+    return current_size, elapsed
+
+
+# Doubles the size until the timeout trips, then bisects between the last
+# size that fit and the first that did not, at increment resolution
+def exponential(max_size: int, increment: int, time_out: float):
+    steps = max_size // increment
+    if steps == 0:
+        return increment, None
+
+    times = {}
+    fitting = 0
+    step = 1
+    while True:
+        step = min(step, steps)
+        times[step] = yield step * increment
+        if times[step] > time_out:
+            break
+        fitting = step
+        if step == steps:
+            return (steps + 1) * increment, times[step]
+        step *= 2
+
+    failing = step
+    while failing - fitting > 1:
+        middle = (fitting + failing) // 2
+        times[middle] = yield middle * increment
+        if times[middle] > time_out:
+            failing = middle
+        else:
+            fitting = middle
+    return failing * increment, times[failing]
+
+
+def get(name: str, max_size: int, increment: int, time_out: float):
+    if name == "exponential":
+        return exponential(max_size, increment, time_out)
+    return linear(max_size, increment, time_out)
+
+
+# Steps a strategy from a loop, so measurements can be yielded or awaited
+# as they are taken:
+#
+#     sweep = Sweep(strategy)
+#     for size in sweep:
+#         sweep.record(measure(size))
+#     size, time, probes = sweep.result
+class Sweep:
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.probes = 0
+        self.result = None
+        self.elapsed = None
+
+    def __iter__(self):
+        try:
+            size = next(self.strategy)
+            while True:
+                yield size
+                self.probes += 1
+                size = self.strategy.send(self.elapsed)
+        except StopIteration as stop:
+            self.result = stop.value + (self.probes,)
+
+    def record(self, elapsed: float):
+        self.elapsed = elapsed
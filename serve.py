@@ -0,0 +1,92 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import workers
+
+# Runs an api with several worker processes, one per usable cpu unless
+# WEB_CONCURRENCY says otherwise.
+#
+#   python serve.py api1:app --port 8000
+#   WEB_CONCURRENCY=4 python serve.py api2:app --port 8001 --server gunicorn
+#
+# uvicorn starts its workers as fresh interpreters, gunicorn forks them
+# from the master before importing the app. Either way each worker sets up
+# its own telemetry when it starts serving. Admission limits are split
+# between the workers, jobs cannot be: a job lives in the worker that
+# accepted it, so the /jobs endpoints answer 501 with more than one worker.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+SERVERS = ("uvicorn", "gunicorn")
+
+
+# Empties a directory the workers share, left over by a previous run
+def reset_dir(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def prepare(name: str, count: int):
+    os.environ["WEB_CONCURRENCY"] = str(count)
+    reset_dir(workers.slots_dir(name))
+    os.environ["WORKER_SLOTS_DIR"] = workers.slots_dir(name)
+    if os.getenv("METRICS_MODE") == "prometheus" and count > 1:
+        directory = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.path.join(
+            tempfile.gettempdir(), f"{name}-metrics"
+        )
+        reset_dir(directory)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run an api with several workers")
+    parser.add_argument("app", help="module:attribute of the ASGI app, e.g. api1:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="defaults to WEB_CONCURRENCY or cpus"
+    )
+    parser.add_argument(
+        "--server", choices=SERVERS, default=os.getenv("WEB_SERVER", "uvicorn")
+    )
+    args = parser.parse_args(argv)
+
+    count = args.workers or workers.count()
+    name = args.app.split(":")[0]
+    prepare(name, count)
+    logger.info(f"Serving {args.app} on {args.host}:{args.port} with {count} workers")
+    if count > 1:
+        logger.warning("The job api needs a single worker, /jobs answers 501")
+
+    if args.server == "gunicorn":
+        os.execvp(
+            "gunicorn",
+            [
+                "gunicorn",
+                args.app,
+                "--worker-class",
+                "uvicorn.workers.UvicornWorker",
+                "--workers",
+                str(count),
+                "--bind",
+                f"{args.host}:{args.port}",
+            ],
+        )
+
+    import uvicorn
+
+    uvicorn.run(args.app, host=args.host, port=args.port, workers=count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
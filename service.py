@@ -0,0 +1,254 @@
+import json
+import os
+
+import pydantic
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from opentelemetry import trace
+
+import admission
+import cancellation
+import execution
+import jobs
+import metering
+import prober
+import profiling
+import telemetry as telemetry_module
+import tracing
+import workers
+from workloads import Workloads
+
+# Endpoints the admission control limits
+ADMITTED_ENDPOINTS = [
+    "/latency",
+    "/sort",
+    "/calculate-pi",
+    "/sum-of-n-numbers",
+    "/object-creation-deletion",
+    "/complexity",
+]
+
+
+# Builds an api serving the shared workloads under an execution engine (see
+# execution.ENGINES). Every api gets the same endpoints, jobs, admission
+# control and telemetry, its metrics named after `name`, so comparing two of
+# them compares only how they run the workloads.
+def create_app(name: str, service_name: str, engine: str) -> FastAPI:
+    execution.configure(engine)
+    telemetry = telemetry_module.Telemetry(
+        name,
+        service_name,
+        {"execution.engine": engine, "executor.workers": execution.EXECUTOR_WORKERS},
+    )
+    workloads = Workloads(telemetry)
+    tracer = telemetry.tracer
+
+    app = FastAPI()
+    app.state.telemetry = telemetry
+    app.state.workloads = workloads
+
+    job_manager = jobs.JobManager(
+        wait_histogram=telemetry.job_wait_histogram,
+        run_histogram=telemetry.job_run_histogram,
+    )
+    telemetry.observe_jobs(job_manager)
+    rtt_monitor = prober.monitor_from_env()
+    telemetry.observe_rtt(rtt_monitor)
+    app.state.job_manager = job_manager
+
+    # Registered first so the other startup handlers already have the
+    # providers of this worker
+    @app.on_event("startup")
+    def setup_telemetry():
+        telemetry.setup()
+
+    @app.on_event("startup")
+    def start_rtt_monitor():
+        rtt_monitor.start()
+
+    @app.on_event("startup")
+    def start_job_workers():
+        if workers.serving() == 1:
+            job_manager.start()
+
+    @app.on_event("shutdown")
+    async def stop_rtt_monitor():
+        await rtt_monitor.stop()
+
+    @app.on_event("shutdown")
+    def shutdown_executor():
+        execution.shutdown()
+
+    # With PROFILING_ENABLED every workload endpoint takes profile=cpu|mem
+    def endpoint(func):
+        if profiling.ENABLED:
+            func = profiling.wrap(func, tracer)
+        return func
+
+    app.get("/latency")(endpoint(workloads.latency_app))
+    app.get("/sort")(execution.handler(endpoint(workloads.sort_app)))
+    app.get("/calculate-pi")(
+        execution.handler(endpoint(workloads.calculate_pi_endpoint))
+    )
+    app.get("/sum-of-n-numbers")(
+        execution.handler(endpoint(workloads.sum_of_n_numbers))
+    )
+    app.get("/object-creation-deletion")(
+        execution.handler(endpoint(workloads.test_object_creation_deletion))
+    )
+    app.get("/complexity")(execution.handler(endpoint(workloads.complexity_endpoint)))
+
+    # Long running workloads can also be submitted as jobs, with the same
+    # query parameters as their GET endpoint. Jobs run on the job workers'
+    # threads whatever the engine. A job lives in the memory of the worker
+    # that accepted it, so the job api is refused when the server runs more
+    # than one.
+    jobs_enabled = workers.serving() == 1
+
+    def require_jobs():
+        if not jobs_enabled:
+            raise HTTPException(
+                status_code=501,
+                detail="Jobs need a single worker, run with WEB_CONCURRENCY=1",
+            )
+
+    job_manager.register("sort", workloads.sort_app, stream=False, format="ndjson")
+    job_manager.register("calculate-pi", workloads.calculate_pi_endpoint)
+    job_manager.register("sum-of-n-numbers", workloads.sum_of_n_numbers)
+    job_manager.register(
+        "object-creation-deletion", workloads.test_object_creation_deletion
+    )
+    job_manager.register("complexity", workloads.complexity_endpoint)
+
+    @app.post("/jobs/{workload}", status_code=202)
+    def submit_job(workload: str, request: Request):
+        require_jobs()
+        with tracer.start_as_current_span(
+            "submit_job", kind=trace.SpanKind.SERVER
+        ) as span:
+            workloads.count_request("/jobs", method="POST")
+            span.set_attribute("workload", workload)
+            try:
+                job = job_manager.submit(workload, dict(request.query_params))
+            except KeyError:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Unknown workload {workload}, choose from {list(job_manager.workloads)}",
+                )
+            except pydantic.ValidationError as error:
+                raise HTTPException(
+                    status_code=422, detail=json.loads(error.json(include_url=False))
+                )
+            except jobs.QueueFull as error:
+                raise HTTPException(
+                    status_code=429, detail=str(error), headers={"Retry-After": "1"}
+                )
+            span.set_attribute("job_id", job.id)
+            return job.describe()
+
+    @app.get("/jobs/{job_id}")
+    def get_job(job_id: str):
+        require_jobs()
+        job = job_manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job.describe()
+
+    @app.delete("/jobs/{job_id}")
+    def cancel_job(job_id: str):
+        require_jobs()
+        job = job_manager.cancel(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job.describe()
+
+    # Profile recorded by a request made with profile=cpu|mem, by the trace
+    # id in its X-Profile-Id header
+    @app.get("/profiles/{trace_id}")
+    def get_profile(trace_id: str):
+        path = profiling.find(trace_id) if profiling.ENABLED else None
+        if path is None:
+            raise HTTPException(status_code=404, detail=f"No profile for {trace_id}")
+        return FileResponse(
+            path,
+            media_type="application/octet-stream",
+            filename=os.path.basename(path),
+        )
+
+    # Prometheus scrape target when METRICS_MODE=prometheus
+    @app.get("/metrics")
+    def metrics_app():
+        if metering.MODE != "prometheus":
+            raise HTTPException(
+                status_code=404, detail="Metrics are pushed over OTLP, see METRICS_MODE"
+            )
+        return Response(content=metering.render(), media_type=metering.CONTENT_TYPE)
+
+    # The hot loops raise Cancelled once the client is gone or the deadline
+    # of the request passed. The spans they unwind through end with an error
+    # status carrying the reason.
+    @app.exception_handler(cancellation.Cancelled)
+    def cancelled_handler(request: Request, cancelled: cancellation.Cancelled):
+        telemetry.cancelled_work_counter.add(
+            cancelled.elapsed,
+            attributes={"endpoint": request.url.path, "reason": cancelled.reason},
+        )
+        status_code = 504 if cancelled.reason == cancellation.DEADLINE_EXCEEDED else 499
+        return JSONResponse(
+            status_code=status_code,
+            content={"detail": f"Cancelled: {cancelled.reason}"},
+        )
+
+    app.add_middleware(cancellation.CancellationMiddleware)
+    app.add_middleware(tracing.EndpointMiddleware)
+
+    @app.middleware("http")
+    async def count_active_requests(request: Request, call_next):
+        telemetry.active_requests.add(1)
+        response = await call_next(request)
+        telemetry.active_requests.add(-1)
+        return response
+
+    admission_control = admission.AdmissionControl(
+        endpoints=ADMITTED_ENDPOINTS, workers=workers.serving()
+    )
+
+    # Registered after count_active_requests so it runs first, shed requests
+    # never count as active
+    @app.middleware("http")
+    async def admit_requests(request: Request, call_next):
+        endpoint = request.url.path
+        limiter = admission_control.limiter(endpoint)
+        if limiter is None:
+            return await call_next(request)
+        try:
+            if await limiter.acquire():
+                telemetry.queued_requests.add(1, attributes={"endpoint": endpoint})
+        except admission.Shed as shed:
+            telemetry.shed_requests.add(
+                1, attributes={"endpoint": endpoint, "reason": shed.reason}
+            )
+            return JSONResponse(
+                status_code=shed.status_code,
+                content={"detail": f"{endpoint} is over capacity ({shed.reason})"},
+                headers={"Retry-After": str(admission.ADMISSION_RETRY_AFTER)},
+            )
+        try:
+            response = await call_next(request)
+        except BaseException:
+            limiter.release()
+            raise
+        body = response.body_iterator
+
+        # the slot is held until the whole body has been sent
+        async def release_after_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                limiter.release()
+
+        response.body_iterator = release_after_body()
+        return response
+
+    return app
@@ -0,0 +1,20 @@
+import json
+
+# Wire formats of the streamed endpoints: one JSON document per line, or
+# server-sent events whose event name is the record's type
+FORMATS = ("ndjson", "sse")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# Headers that keep proxies from buffering the stream
+HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def encode(record: dict, format: str = "ndjson") -> str:
+    data = json.dumps(record)
+    if format == "sse":
+        return f"event: {record.get('type', 'message')}\ndata: {data}\n\n"
+    return data + "\n"
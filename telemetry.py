@@ -0,0 +1,232 @@
+import os
+from typing import Iterable
+
+from opentelemetry import metrics, trace
+from opentelemetry.sdk.metrics.view import (ExplicitBucketHistogramAggregation,
+                                            View)
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+
+import complexity
+import kernels
+import latency_stats
+import metering
+import tracing
+import workers
+
+TRACES_ENDPOINT = os.getenv(
+    "TRACES_ENDPOINT", "http://op-otel-collector-1:4321/v1/traces"
+)
+METRICS_ENDPOINT = os.getenv(
+    "METRICS_ENDPOINT", "http://op-otel-collector-1:4321/v1/metrics"
+)
+# Push interval of the OTLP metrics, the same for every api so they pay the
+# same export cost
+METRICS_EXPORT_INTERVAL_MS = 1000
+
+
+# Tracer and instruments of one api, every metric name starting with `name`
+# (api_1, api_2). The instruments are created at import, as OTel proxies
+# until setup() installs the providers in the worker process serving it.
+class Telemetry:
+    def __init__(self, name: str, service_name: str, attributes: dict = None):
+        self.name = name
+        self.resource = Resource(
+            attributes={SERVICE_NAME: service_name, **(attributes or {})}
+        )
+        self.provider = None
+        self.meter_provider = None
+
+        self.tracer = trace.get_tracer("api.tracer")
+        meter = metrics.get_meter(service_name)
+        self.meter = meter
+
+        self.request_count = meter.create_counter(
+            f"{name}_total_requests",
+            unit="1",
+            description="Number of processed requests",
+        )
+        self.rtt_histogram = meter.create_histogram(
+            f"{name}_rtt_histogram",
+            unit="s",
+            description="Round-Trip Time (RTT) per host",
+        )
+        self.sort_histogram = meter.create_histogram(
+            f"{name}_sort_histogram",
+            unit="1",
+            description="Max size of sort list before reaching timeout",
+        )
+        self.sum_histogram = meter.create_histogram(
+            f"{name}_sum_of_n_number_histogram",
+            unit="float",
+            description="Results of the sum of n numbers with 3 methods",
+        )
+        self.pi_histogram = meter.create_histogram(
+            f"{name}_pi_histogram", unit="float", description="Results of pi calculation"
+        )
+        self.pi_throughput_histogram = meter.create_histogram(
+            f"{name}_pi_samples_per_second",
+            unit="1/s",
+            description="Monte Carlo samples drawn per second by each pi engine",
+        )
+        self.object_memory_histogram = meter.create_histogram(
+            f"{name}_object_bytes_per_object",
+            unit="By",
+            description="Bytes allocated per object by each object creation strategy",
+        )
+        self.allocation_rate_histogram = meter.create_histogram(
+            f"{name}_object_allocation_rate",
+            unit="1/s",
+            description="Objects created per second by each object creation strategy",
+        )
+        self.active_requests = meter.create_up_down_counter(
+            f"{name}_active_requests", unit="1", description="Number of active requests"
+        )
+        self.shed_requests = meter.create_counter(
+            f"{name}_shed_requests",
+            unit="1",
+            description="Requests rejected by admission control",
+        )
+        self.queued_requests = meter.create_counter(
+            f"{name}_queued_requests",
+            unit="1",
+            description="Requests that waited for an admission slot",
+        )
+        self.cancelled_work_counter = meter.create_counter(
+            f"{name}_cancelled_work_seconds",
+            unit="s",
+            description="Time spent on requests abandoned by the client or past their deadline",
+        )
+        self.job_wait_histogram = meter.create_histogram(
+            f"{name}_job_wait_time", unit="s", description="Time jobs spent queued"
+        )
+        self.job_run_histogram = meter.create_histogram(
+            f"{name}_job_run_time", unit="s", description="Time jobs spent running"
+        )
+
+        meter.create_observable_gauge(
+            f"{name}_complexity_exponent",
+            [observable_complexity_function("exponent")],
+            unit="1",
+            description="Fitted exponent of the time of each kernel against its input size",
+        )
+        meter.create_observable_gauge(
+            f"{name}_complexity_r2",
+            [observable_complexity_function("r2")],
+            unit="1",
+            description=(
+                f"R squared of the log-log fit behind {name}_complexity_exponent"
+            ),
+        )
+        meter.create_observable_gauge(
+            f"{name}_complexity_predicted_size",
+            [observable_complexity_function("predicted_size")],
+            unit="1",
+            description="Largest input size each kernel should handle within the budget",
+        )
+        meter.create_observable_counter(
+            f"{name}_dropped_spans",
+            [observable_spans_function],
+            unit="1",
+            description="Spans lost to a full export queue or a failed export",
+        )
+        meter.create_observable_counter(
+            f"{name}_exported_spans",
+            [observable_exported_spans_function],
+            unit="1",
+            description="Spans delivered to the collector",
+        )
+
+    def observe_jobs(self, job_manager):
+        def observe(options: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+            yield metrics.Observation(job_manager.queue_length(), {})
+
+        self.meter.create_observable_gauge(
+            f"{self.name}_job_queue_length",
+            [observe],
+            unit="1",
+            description="Number of jobs waiting for a worker",
+        )
+
+    # Only reads the values cached by the background prober, the metric
+    # export never waits on the network
+    def observe_rtt(self, rtt_monitor):
+        def observe_rtt(
+            options: metrics.CallbackOptions,
+        ) -> Iterable[metrics.Observation]:
+            for host, (rtt, _) in list(rtt_monitor.latest.items()):
+                yield metrics.Observation(rtt, {"host": host})
+
+        def observe_timestamp(
+            options: metrics.CallbackOptions,
+        ) -> Iterable[metrics.Observation]:
+            for host, (_, timestamp) in list(rtt_monitor.latest.items()):
+                yield metrics.Observation(timestamp, {"host": host})
+
+        self.meter.create_observable_gauge(
+            f"{self.name}_rtt_gauge",
+            [observe_rtt],
+            unit="s",
+            description="Last Round-Trip Time (RTT) measured by the background prober",
+        )
+        self.meter.create_observable_gauge(
+            f"{self.name}_rtt_gauge_timestamp",
+            [observe_timestamp],
+            unit="s",
+            description=f"Unix time of the last reply behind {self.name}_rtt_gauge",
+        )
+
+    # Installs the tracer and meter providers. Called by each worker process
+    # as it starts serving rather than at import, so no exporter thread is
+    # shared with a parent that forks the workers.
+    def setup(self):
+        if self.provider is not None:
+            return
+        resource = self.resource.merge(
+            Resource(attributes=workers.resource_attributes(self.name))
+        )
+        self.provider = tracing.setup(resource, TRACES_ENDPOINT)
+        self.meter_provider = metering.setup(
+            resource,
+            METRICS_ENDPOINT,
+            views=[
+                View(
+                    instrument_name=f"{self.name}_rtt_histogram",
+                    aggregation=ExplicitBucketHistogramAggregation(
+                        latency_stats.RTT_BUCKETS
+                    ),
+                )
+            ],
+            export_interval_millis=METRICS_EXPORT_INTERVAL_MS,
+        )
+
+
+def observable_complexity_function(field: str):
+    def observe(options: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+        for kernel, report in list(complexity.latest.items()):
+            if field == "predicted_size":
+                if report["predicted_size"] is not None:
+                    # an int64 is all OTLP takes, anything above fails the
+                    # whole export
+                    yield metrics.Observation(
+                        min(report["predicted_size"], kernels.INT64_MAX),
+                        {"kernel": kernel, "budget": report["budget"]},
+                    )
+            elif report["fit"] is not None:
+                yield metrics.Observation(report["fit"][field], {"kernel": kernel})
+
+    return observe
+
+
+def observable_spans_function(
+    options: metrics.CallbackOptions,
+) -> Iterable[metrics.Observation]:
+    yield metrics.Observation(tracing.stats["queue_full"], {"reason": "queue_full"})
+    yield metrics.Observation(
+        tracing.stats["export_failed"], {"reason": "export_failed"}
+    )
+
+
+def observable_exported_spans_function(
+    options: metrics.CallbackOptions,
+) -> Iterable[metrics.Observation]:
+    yield metrics.Observation(tracing.stats["exported"], {})
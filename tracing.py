@@ -0,0 +1,222 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from opentelemetry import trace
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+    OTLPSpanExporter as OTLPSpanExporterHTTP
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (BatchSpanProcessor, SpanExporter,
+                                            SpanExportResult)
+from opentelemetry.sdk.trace.sampling import (ParentBased, Sampler,
+                                              TraceIdRatioBased)
+from opentelemetry.trace import Status, StatusCode
+
+# Tracing policy of both apis, from the environment:
+#   TRACE_SAMPLE_RATIO      - share of requests traced, 1 traces everything
+#   TRACE_SAMPLE_OVERRIDES  - per endpoint ratios, "/latency=0.01,/jobs=1";
+#                             the longest matching path prefix wins
+#   TRACE_ITERATIONS        - "spans" for a child span per ping or sort step,
+#                             "events" to record them as events on the parent
+#   TRACE_BATCH_SIZE, TRACE_QUEUE_SIZE, TRACE_SCHEDULE_DELAY_MS,
+#   TRACE_EXPORT_TIMEOUT_MS - BatchSpanProcessor settings, unset keeps the
+#                             SDK defaults (and its OTEL_BSP_* variables)
+# Spans of a sampled request are all kept: only the root span is sampled,
+# its children follow its decision.
+
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def parse_overrides(value: str) -> dict:
+    overrides = {}
+    for item in value.split(","):
+        if "=" in item:
+            path, ratio = item.split("=", 1)
+            overrides[path.strip()] = float(ratio)
+    return overrides
+
+
+SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 1.0))
+SAMPLE_OVERRIDES = parse_overrides(os.getenv("TRACE_SAMPLE_OVERRIDES", ""))
+ITERATIONS = os.getenv("TRACE_ITERATIONS", "spans")
+BATCH_SIZE = _optional_int("TRACE_BATCH_SIZE")
+QUEUE_SIZE = _optional_int("TRACE_QUEUE_SIZE")
+SCHEDULE_DELAY_MS = _optional_int("TRACE_SCHEDULE_DELAY_MS")
+EXPORT_TIMEOUT_MS = _optional_int("TRACE_EXPORT_TIMEOUT_MS")
+
+# Path of the request being served, for the sampler
+_endpoint = contextvars.ContextVar("endpoint", default=None)
+
+
+# Samples root spans at the ratio configured for the endpoint of the request
+# they belong to, spans started outside a request use the default ratio
+class EndpointSampler(Sampler):
+    def __init__(self, ratio: float = SAMPLE_RATIO, overrides: dict = None):
+        self.default = TraceIdRatioBased(ratio)
+        self.overrides = sorted(
+            (
+                (path, TraceIdRatioBased(value))
+                for path, value in (overrides or {}).items()
+            ),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def sampler_for(self, path: str) -> Sampler:
+        if path is not None:
+            for prefix, sampler in self.overrides:
+                if path.startswith(prefix):
+                    return sampler
+        return self.default
+
+    def should_sample(
+        self, parent_context, trace_id, name, kind=None, attributes=None, links=None
+    ):
+        path = _endpoint.get()
+        if path is None and attributes:
+            # server spans opened by http instrumentation before the
+            # middleware runs carry the path as an attribute
+            path = attributes.get("url.path") or attributes.get("http.target")
+            if path is not None:
+                path = path.split("?", 1)[0]
+        return self.sampler_for(path).should_sample(
+            parent_context, trace_id, name, kind, attributes, links
+        )
+
+    def get_description(self) -> str:
+        return "EndpointSampler"
+
+
+# ASGI middleware that makes the request path visible to the sampler
+class EndpointMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        reset = _endpoint.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _endpoint.reset(reset)
+
+
+# Span counts of the exporter pipeline, read by the apis' observable
+# counters: spans exported, spans the exporter gave up on and spans
+# dropped because the processor queue was full
+stats = {"exported": 0, "export_failed": 0, "queue_full": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str, value: int):
+    with _stats_lock:
+        stats[key] += value
+
+
+class CountingExporter(SpanExporter):
+    def __init__(self, exporter: SpanExporter):
+        self.exporter = exporter
+
+    def export(self, spans):
+        result = self.exporter.export(spans)
+        if result == SpanExportResult.SUCCESS:
+            _count("exported", len(spans))
+        else:
+            _count("export_failed", len(spans))
+        return result
+
+    def shutdown(self):
+        return self.exporter.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.exporter.force_flush(timeout_millis)
+
+
+# BatchSpanProcessor that counts the spans it drops when its queue is full.
+# The queue is internal to the SDK and has moved between versions, where it
+# cannot be found nothing is counted.
+class CountingBatchSpanProcessor(BatchSpanProcessor):
+    def __init__(self, exporter: SpanExporter, max_queue_size: int = None, **kwargs):
+        super().__init__(exporter, max_queue_size=max_queue_size, **kwargs)
+        batch = getattr(self, "_batch_processor", self)
+        self._pending = getattr(batch, "_queue", None)
+        if self._pending is None:
+            self._pending = getattr(batch, "queue", None)
+        self._capacity = getattr(batch, "_max_queue_size", None) or getattr(
+            batch, "max_queue_size", None
+        )
+
+    def on_end(self, span):
+        if (
+            self._pending is not None
+            and self._capacity
+            and span.context
+            and span.context.trace_flags.sampled
+            and len(self._pending) >= self._capacity
+        ):
+            _count("queue_full", 1)
+        super().on_end(span)
+
+
+def setup(resource, endpoint: str) -> TracerProvider:
+    sampler = ParentBased(EndpointSampler(SAMPLE_RATIO, SAMPLE_OVERRIDES))
+    provider = TracerProvider(resource=resource, sampler=sampler)
+    processor = CountingBatchSpanProcessor(
+        CountingExporter(OTLPSpanExporterHTTP(endpoint=endpoint)),
+        max_queue_size=QUEUE_SIZE,
+        schedule_delay_millis=SCHEDULE_DELAY_MS,
+        max_export_batch_size=BATCH_SIZE,
+        export_timeout_millis=EXPORT_TIMEOUT_MS,
+    )
+    provider.add_span_processor(processor)
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+# Collects the attributes of one iteration and adds them to the parent
+# span as a single event when the iteration ends
+class IterationEvent:
+    def __init__(self, name: str):
+        self.name = name
+        self.timestamp = time.time_ns()
+        self.attributes = {}
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception, *args, **kwargs):
+        self.attributes["exception"] = repr(exception)
+
+
+# One iteration of a hot loop (a ping, a sort step): a child span of
+# `parent_span`, or with TRACE_ITERATIONS=events an event on it. Either way
+# the body gets an object with set_attribute(). Nothing is recorded when the
+# parent is not sampled.
+@contextlib.contextmanager
+def iteration(tracer, name: str, parent_span, kind=trace.SpanKind.INTERNAL):
+    if ITERATIONS != "events":
+        with tracer.start_as_current_span(
+            name, kind=kind, context=trace.set_span_in_context(parent_span)
+        ) as span:
+            yield span
+        return
+    event = IterationEvent(name)
+    try:
+        yield event
+    finally:
+        if parent_span.is_recording():
+            event.attributes["duration"] = (time.time_ns() - event.timestamp) / 1e9
+            parent_span.add_event(name, event.attributes, timestamp=event.timestamp)
+
+
+# What start_as_current_span does to a span an exception escapes from, for
+# the spans that are ended by hand
+def fail(span, error: BaseException):
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, f"{type(error).__name__}: {error}"))
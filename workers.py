@@ -0,0 +1,80 @@
+import fcntl
+import os
+import socket
+import tempfile
+
+# Worker processes of one api: how many to run and which one this is.
+#   WEB_CONCURRENCY   - number of workers, by default one per usable cpu.
+#                       Jobs stay in the worker that accepted them, so the
+#                       /jobs endpoints are only served with a single worker
+#   WORKER_SLOTS_DIR  - where workers claim their id, shared by the workers
+#                       of one server
+
+_slots = {}
+
+
+# Cpus this process may run on, limited by the cgroup cpu quota when the
+# container has one
+def cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def count() -> int:
+    value = os.getenv("WEB_CONCURRENCY")
+    return max(1, int(value)) if value else cpu_count()
+
+
+# Workers the running server was started with, set by serve.py. A server
+# started without it is taken to run a single worker.
+def serving() -> int:
+    value = os.getenv("WEB_CONCURRENCY")
+    return max(1, int(value)) if value else 1
+
+
+def slots_dir(name: str) -> str:
+    return os.getenv(
+        "WORKER_SLOTS_DIR", os.path.join(tempfile.gettempdir(), f"{name}-workers")
+    )
+
+
+# Lowest worker id not held by another live worker. The id is an exclusive
+# lock on a file held for the life of the process, so a restarted worker
+# takes over the id of the one it replaces and ids stay within 0..workers-1.
+def worker_id(name: str) -> int:
+    if name in _slots:
+        return _slots[name][0]
+    directory = slots_dir(name)
+    os.makedirs(directory, exist_ok=True)
+    slot = 0
+    while True:
+        handle = open(os.path.join(directory, f"{slot}.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            slot += 1
+            continue
+        _slots[name] = (slot, handle)
+        return slot
+
+
+# Resource attributes that tell the workers of one host apart, so their
+# counters are exported as separate series instead of overwriting each other
+def resource_attributes(name: str) -> dict:
+    slot = worker_id(name)
+    return {
+        "worker.id": slot,
+        "service.instance.id": f"{socket.gethostname()}-{slot}",
+        "process.pid": os.getpid(),
+    }
@@ -0,0 +1,578 @@
+import socket
+import time
+
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+from opentelemetry import trace
+
+import cancellation
+import complexity
+import datasets
+import execution
+import kernels
+import latency_stats
+import memprofile
+import montecarlo
+import prober
+import search as searching
+import streaming
+import tracing
+
+
+# The workloads every api serves, written once as plain sync code with their
+# spans and metrics. Each api only decides where they run (see execution):
+# the CPU bound kernels go through execution.call and the endpoints are
+# wrapped by execution.handler. /latency waits on the network and is async
+# under every engine.
+class Workloads:
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.tracer = telemetry.tracer
+
+    def count_request(self, endpoint: str, method: str = "GET"):
+        self.telemetry.request_count.add(
+            1, attributes={"method:": method, "endpoint": endpoint}
+        )
+
+    async def connectionTest(
+        self, host: str, parent_span, size: int, timeout: float
+    ) -> float:
+        with tracing.iteration(
+            self.tracer, "ping_latency", parent_span, trace.SpanKind.SERVER
+        ) as span:
+            span.set_attribute("payload_size", size)
+            response = await prober.ping(host, size, timeout)
+            if response == None:
+                span.set_attribute("lost", True)
+                return None
+            else:
+                span.set_attribute("ping", response)
+                return response
+
+    async def latency_app(
+        self,
+        tentativas: int = Query(10, ge=1),
+        host: str = Query("8.8.8.8"),
+        size: int = Query(32, ge=1),
+        concurrency: int = Query(prober.PROBE_CONCURRENCY, ge=1),
+        interval: float = Query(prober.PROBE_INTERVAL, ge=0),
+    ):
+        with self.tracer.start_as_current_span(
+            "latency", kind=trace.SpanKind.SERVER
+        ) as span:
+            self.count_request("/latency")
+            span.set_attribute("host", host)
+            span.set_attribute("NumberOfTrys", tentativas)
+            span.set_attribute("payload_size", size)
+            span.set_attribute("concurrency", concurrency)
+            span.set_attribute("interval", interval)
+
+            async def traced_ping(address: str, size: int, timeout: float):
+                return await self.connectionTest(address, span, size, timeout)
+
+            try:
+                rtts = await prober.probe_many(
+                    host, tentativas, size, concurrency, interval, probe=traced_ping
+                )
+            except socket.gaierror:
+                return {
+                    "message": f"Simulated HTTP request to {host} but unable to reach it"
+                }
+
+            received = [rtt for rtt in rtts if rtt is not None]
+            for rtt in received:
+                self.telemetry.rtt_histogram.record(rtt, attributes={"host": host})
+            loss = 1 - len(received) / tentativas
+            span.set_attribute("received", len(received))
+            span.set_attribute("loss", loss)
+
+            host_stats = latency_stats.host_stats(host)
+            host_stats.record(rtts)
+            stats = latency_stats.summarize(rtts)
+            for key, value in stats.items():
+                span.set_attribute(f"rtt.{key}", value)
+
+            if not received:
+                return {
+                    "message": f"Simulated HTTP request to {host} but unable to reach it",
+                    "sent": tentativas,
+                    "received": 0,
+                    "loss": loss,
+                    "stats": stats,
+                    "host_stats": host_stats.summary(),
+                }
+
+            latency = sum(received) / len(received)
+
+            return {
+                "message": f"Simulated HTTP request to {host} for {tentativas} trys",
+                "latency": latency,
+                "sent": tentativas,
+                "received": len(received),
+                "loss": loss,
+                "stats": stats,
+                "host_stats": host_stats.summary(),
+            }
+
+    # Times one registered sort algorithm on a pregenerated dataset
+    def timeSort(self, name: str, dataset: str, seed: int, size: int, parent_span):
+        with tracing.iteration(
+            self.tracer, name, parent_span, trace.SpanKind.SERVER
+        ) as child:
+            total_time = execution.call(
+                kernels.timed_sort_dataset, name, dataset, size, seed
+            )
+            child.set_attribute("sample_size", size)
+            child.set_attribute("total_time", total_time)
+            return total_time
+
+    # Runs the size search of every algorithm and yields a record per
+    # measurement, then one with the algorithm's result. The spans are ended
+    # by hand rather than made current, as a streamed response resumes the
+    # generator from different threads.
+    def sort_records(
+        self,
+        size: int,
+        time_out: float,
+        increment: int,
+        parent_span,
+        search: str = "linear",
+        algorithms=("bubble", "selection", "merge"),
+        dataset: str = "uniform",
+        seed: int = 0,
+    ):
+        parent = self.tracer.start_span(
+            "comparison",
+            kind=trace.SpanKind.SERVER,
+            context=trace.set_span_in_context(parent_span),
+        )
+        try:
+            parent.set_attribute("search", search)
+            parent.set_attribute("algorithms", list(algorithms))
+            parent.set_attribute("dataset", dataset)
+            parent.set_attribute("seed", seed)
+            for name in algorithms:
+                sweep = searching.Sweep(
+                    searching.get(search, size, increment, time_out)
+                )
+                for current_size in sweep:
+                    total_time = self.timeSort(
+                        name, dataset, seed, current_size, parent
+                    )
+                    sweep.record(total_time)
+                    yield {
+                        "type": "measurement",
+                        "algorithm": name,
+                        "size": current_size,
+                        "seconds": total_time,
+                    }
+                current_size, total_time, probes = sweep.result
+                parent.set_attribute(f"{name}_max_reached_size", current_size)
+                if total_time is not None:
+                    parent.set_attribute(f"{name}_max_reached_time", total_time)
+                parent.set_attribute(f"{name}_probes", probes)
+                self.telemetry.sort_histogram.record(
+                    current_size, attributes={"sort_method": name}
+                )
+                yield {
+                    "type": "result",
+                    "algorithm": name,
+                    "max_reached_size": current_size,
+                    "max_reached_time": total_time,
+                    "probes": probes,
+                }
+        except Exception as error:
+            tracing.fail(parent, error)
+            raise
+        finally:
+            parent.end()
+
+    # Function to call the sort methods and collect the metrics
+    def sortComparison(
+        self,
+        size: int,
+        time_out: float,
+        increment: int,
+        parent_span,
+        search: str = "linear",
+        algorithms=("bubble", "selection", "merge"),
+        dataset: str = "uniform",
+        seed: int = 0,
+    ):
+        for _ in self.sort_records(
+            size, time_out, increment, parent_span, search, algorithms, dataset, seed
+        ):
+            pass
+
+    # Body of /sort?stream=true. The client can hang up at any point, which
+    # closes the generator and ends the spans with what was measured so far.
+    # Starlette iterates it on its threadpool whatever the engine.
+    def stream_sort(
+        self,
+        format: str,
+        size: int,
+        time_out: float,
+        increment: int,
+        search: str,
+        algorithms,
+        dataset: str,
+        seed: int,
+    ):
+        span = self.tracer.start_span("sort", kind=trace.SpanKind.SERVER)
+        span.set_attribute("stream", True)
+        span.set_attribute("format", format)
+        started = time.monotonic()
+        try:
+            for record in self.sort_records(
+                size, time_out, increment, span, search, algorithms, dataset, seed
+            ):
+                yield streaming.encode(record, format)
+            yield streaming.encode({"type": "done", "message": "Done sort"}, format)
+        except cancellation.Cancelled as cancelled:
+            tracing.fail(span, cancelled)
+            self.telemetry.cancelled_work_counter.add(
+                cancelled.elapsed,
+                attributes={"endpoint": "/sort", "reason": cancelled.reason},
+            )
+            yield streaming.encode(
+                {"type": "error", "detail": f"Cancelled: {cancelled.reason}"}, format
+            )
+        except Exception as error:
+            tracing.fail(span, error)
+            yield streaming.encode({"type": "error", "detail": repr(error)}, format)
+        finally:
+            span.set_attribute("elapsed", time.monotonic() - started)
+            span.end()
+
+    def sort_app(
+        self,
+        max_size: int = Query(10000, ge=1),
+        time_out: float = Query(2, ge=0.01),
+        increment: int = Query(500, ge=1),
+        search: str = Query("linear", pattern="^(linear|exponential)$"),
+        algorithms: str = Query(kernels.DEFAULT_SORTS),
+        dataset: str = Query("uniform", pattern=f"^({'|'.join(datasets.DATASETS)})$"),
+        seed: int = Query(0, ge=0),
+        stream: bool = Query(False),
+        format: str = Query("ndjson", pattern=f"^({'|'.join(streaming.FORMATS)})$"),
+    ):
+        self.count_request("/sort")
+        try:
+            selected = kernels.parse_sorts(algorithms)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        if dataset != "random" and max_size > datasets.MAX_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"max_size is above the dataset limit of {datasets.MAX_SIZE}",
+            )
+
+        if stream:
+            return StreamingResponse(
+                self.stream_sort(
+                    format,
+                    max_size,
+                    time_out,
+                    increment,
+                    search,
+                    selected,
+                    dataset,
+                    seed,
+                ),
+                media_type=streaming.MEDIA_TYPES[format],
+                headers=streaming.HEADERS,
+            )
+
+        with self.tracer.start_as_current_span(
+            "sort", kind=trace.SpanKind.SERVER
+        ) as span:
+            try:
+                self.sortComparison(
+                    max_size, time_out, increment, span, search, selected, dataset, seed
+                )
+            except datasets.DatasetUnavailable as error:
+                raise HTTPException(
+                    status_code=503, detail=str(error), headers={"Retry-After": "1"}
+                )
+            return {"message": f"Done sort"}
+
+    # calculate pi using the monte carlo method for a given number of seconds
+    # or for a fixed number of samples
+    def calculate_pi(
+        self,
+        seconds: float,
+        parent_span,
+        engine: str = "python",
+        samples: int = None,
+        workers: int = 1,
+        seed: int = None,
+    ):
+        with self.tracer.start_as_current_span(
+            "calculate_pi", context=trace.set_span_in_context(parent_span)
+        ) as span:
+            span.set_attribute("seconds", seconds)
+            span.set_attribute("engine", engine)
+            span.set_attribute("workers", workers)
+            if samples is not None:
+                span.set_attribute("samples", samples)
+            start_time = time.perf_counter()
+            if workers > 1:
+                inside, total = self.calculate_pi_parallel(
+                    seconds, span, engine, samples, workers, seed
+                )
+            else:
+                inside, total = execution.call(
+                    montecarlo.estimate, engine, seconds, samples
+                )
+            elapsed = time.perf_counter() - start_time
+            pi = 4 * inside / total
+            samples_per_second = total / elapsed if elapsed > 0 else 0.0
+            span.set_attribute("inside", inside)
+            span.set_attribute("total", total)
+            span.set_attribute("pi", pi)
+            span.set_attribute("elapsed", elapsed)
+            span.set_attribute("samples_per_second", samples_per_second)
+            self.telemetry.pi_histogram.record(pi)
+            self.telemetry.pi_throughput_histogram.record(
+                samples_per_second, attributes={"engine": engine}
+            )
+            return pi, total, samples_per_second
+
+    # Spreads the estimation over the process pool and merges the counts,
+    # adding one span per worker with the timestamps measured inside it
+    def calculate_pi_parallel(
+        self,
+        seconds: float,
+        parent_span,
+        engine: str,
+        samples: int,
+        workers: int,
+        seed: int,
+    ):
+        futures = montecarlo.submit_parallel(engine, workers, seconds, samples, seed)
+        inside = 0
+        total = 0
+        for index, future in enumerate(futures):
+            result = cancellation.result(future)
+            child = self.tracer.start_span(
+                "calculate_pi_worker",
+                context=trace.set_span_in_context(parent_span),
+                start_time=result["start_ns"],
+            )
+            child.set_attribute("worker", index)
+            child.set_attribute("pid", result["pid"])
+            child.set_attribute("inside", result["inside"])
+            child.set_attribute("total", result["total"])
+            child.end(end_time=result["end_ns"])
+            inside += result["inside"]
+            total += result["total"]
+        return inside, total
+
+    def calculate_pi_endpoint(
+        self,
+        seconds: float = Query(1, ge=0.0001),
+        engine: str = Query("python", pattern="^(python|numpy)$"),
+        samples: int = Query(None, ge=1),
+        workers: int = Query(1, ge=1),
+        seed: int = Query(None, ge=0),
+    ):
+        with self.tracer.start_as_current_span("calculate_pi_endpoint") as span:
+            pi, total, samples_per_second = self.calculate_pi(
+                seconds, span, engine, samples, workers, seed
+            )
+            self.count_request("/calculate-pi")
+            return {
+                "pi": pi,
+                "engine": engine,
+                "workers": min(workers, montecarlo.POOL_SIZE),
+                "samples": total,
+                "samples_per_second": samples_per_second,
+            }
+
+    # Sums 0..target with one method. With a deadline the chunked methods stop
+    # early and report how many of the numbers they got to.
+    def sum_method(
+        self, method: str, target: int, parent_span, deadline: float, workers: int
+    ):
+        with self.tracer.start_as_current_span(
+            "sum_method", context=trace.set_span_in_context(parent_span)
+        ) as span:
+            label = kernels.SUM_METHOD_LABELS.get(method, method)
+            span.set_attribute("method", label)
+            span.set_attribute("target", target)
+            start_time = time.perf_counter()
+            if method == "formula":
+                result, summed = kernels.sum_formula(target), target + 1
+            elif method == "parallel":
+                result, summed = self.sum_parallel(target, workers, deadline)
+            else:
+                result, summed = execution.call(
+                    kernels.sum_range, method, 0, target + 1, deadline
+                )
+            elapsed = time.perf_counter() - start_time
+            complete = summed == target + 1
+            span.set_attribute("result", result)
+            span.set_attribute("summed", summed)
+            span.set_attribute("complete", complete)
+            span.set_attribute("elapsed", elapsed)
+            self.telemetry.sum_histogram.record(result, attributes={"method": label})
+            return {
+                "result": result,
+                "complete": complete,
+                "summed": summed,
+                "progress": summed / (target + 1),
+                "seconds": elapsed,
+            }
+
+    def sum_parallel(self, target: int, workers: int, deadline: float):
+        futures = kernels.submit_sum_parallel(
+            montecarlo.get_pool(),
+            target,
+            min(workers, montecarlo.POOL_SIZE),
+            "builtin",
+            deadline,
+        )
+        result = 0
+        summed = 0
+        for future in futures:
+            partial, count = cancellation.result(future)
+            result += partial
+            summed += count
+        return result, summed
+
+    def sum_of_n_numbers(
+        self,
+        target: int = Query(100000000, ge=1),
+        methods: str = Query(kernels.DEFAULT_SUM_METHODS),
+        budget_ms: float = Query(0, ge=0),
+        workers: int = Query(montecarlo.POOL_SIZE, ge=1),
+    ):
+        try:
+            selected = kernels.parse_sum_methods(methods)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        with self.tracer.start_as_current_span("sum_of_n_numbers") as span:
+            span.set_attribute("budget_ms", budget_ms)
+            results = {}
+            for method in selected:
+                # every method gets the whole budget
+                deadline = time.time() + budget_ms / 1000 if budget_ms > 0 else None
+                results[method] = self.sum_method(
+                    method, target, span, deadline, workers
+                )
+            self.count_request("/sum-of-n-numbers")
+            response = {"target": target, "budget_ms": budget_ms, "methods": results}
+            for method, label in kernels.SUM_METHOD_LABELS.items():
+                if method in results:
+                    response[f"{label}_result"] = results[method]["result"]
+            return response
+
+    # With `memory` the objects are also built under tracemalloc and the run
+    # watches RSS and the garbage collector, see memprofile
+    def create_delete_objects(
+        self, strategy: str, count: int, parent_span, memory: bool = False
+    ):
+        with self.tracer.start_as_current_span(
+            "create_delete_objects", context=trace.set_span_in_context(parent_span)
+        ) as span:
+            span.set_attribute("strategy", strategy)
+            span.set_attribute("object_count", count)
+            report = execution.call(memprofile.profile, strategy, count, memory)
+            span.set_attribute("container_size", report["container_size"])
+            attributes = {"strategy": strategy}
+            if not memory:
+                span.set_attribute("object_size", report["container_size"])
+            else:
+                # bytes Python allocated for the objects, not only the list
+                # holding them
+                span.set_attribute("object_size", report["tracemalloc"]["held"])
+                span.set_attribute("peak_size", report["tracemalloc"]["peak"])
+                span.set_attribute("net_size", report["tracemalloc"]["net"])
+                span.set_attribute("bytes_per_object", report["bytes_per_object"])
+                if report["rss_delta"] is not None:
+                    span.set_attribute("rss_delta", report["rss_delta"])
+                span.set_attribute("gc_collections", sum(report["gc"]["collections"]))
+                span.set_attribute("gc_seconds", report["gc"]["seconds"])
+                self.telemetry.object_memory_histogram.record(
+                    report["bytes_per_object"], attributes
+                )
+            if report["objects_per_second"] is not None:
+                span.set_attribute("objects_per_second", report["objects_per_second"])
+                self.telemetry.allocation_rate_histogram.record(
+                    report["objects_per_second"], attributes
+                )
+            span.set_attribute("status", "completed")
+            return report
+
+    def test_object_creation_deletion(
+        self,
+        count: int = Query(1000000, ge=1),
+        strategies: str = Query(kernels.DEFAULT_OBJECT_STRATEGIES),
+        memory: bool = Query(False),
+    ):
+        try:
+            selected = kernels.parse_object_strategies(strategies)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        with self.tracer.start_as_current_span("test_object_creation_deletion") as span:
+            results = {
+                strategy: self.create_delete_objects(strategy, count, span, memory)
+                for strategy in selected
+            }
+            self.count_request("/object-creation-deletion")
+            response = {"count": count, "strategies": results}
+            for strategy in results:
+                if strategy in kernels.OBJECT_RESULTS:
+                    key, message = kernels.OBJECT_RESULTS[strategy]
+                    response[key] = message
+            return response
+
+    def complexity_endpoint(
+        self,
+        kernel: str = Query("sort_merge"),
+        min_size: int = Query(1000, ge=1),
+        max_size: int = Query(1000000, ge=1),
+        factor: float = Query(2.0, gt=1),
+        repetitions: int = Query(3, ge=1, le=50),
+        budget: float = Query(1.0, gt=0),
+        max_seconds: float = Query(10.0, gt=0),
+        seed: int = Query(0, ge=0),
+    ):
+        self.count_request("/complexity")
+        try:
+            kernel = kernels.parse_kernel(kernel)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        if min_size > max_size:
+            raise HTTPException(status_code=400, detail="min_size is above max_size")
+        if kernel.startswith("sort_") and max_size > datasets.MAX_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"max_size is above the dataset limit of {datasets.MAX_SIZE}",
+            )
+
+        with self.tracer.start_as_current_span("complexity") as span:
+            span.set_attribute("kernel", kernel)
+            span.set_attribute("budget", budget)
+            report = execution.call(
+                complexity.analyze,
+                kernel,
+                min_size,
+                max_size,
+                factor,
+                repetitions,
+                budget,
+                max_seconds,
+                seed,
+            )
+            for point in report["points"]:
+                span.add_event("measurement", point)
+            span.set_attribute("stopped", report["stopped"])
+            if report["fit"] is not None:
+                span.set_attribute("exponent", report["fit"]["exponent"])
+                span.set_attribute("constant", report["fit"]["constant"])
+                span.set_attribute("r2", report["fit"]["r2"])
+            if report["predicted_size"] is not None:
+                span.set_attribute("predicted_size", report["predicted_size"])
+            complexity.latest[kernel] = report
+            return report